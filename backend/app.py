@@ -1,8 +1,9 @@
-from flask import Flask, request, jsonify, redirect, session
+from flask import Flask, Response, request, jsonify, redirect, g, send_file
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta, timezone
+from functools import wraps
 import re
 import os
 import json
@@ -10,33 +11,112 @@ import requests
 import urllib.parse
 import secrets
 import base64
+import atexit
+
+from utils.tokens import TokenSigner, TokenError
+from utils.user_cache import IdentityCache
+from utils.spotify_catalog import SpotifyCatalog
+from utils.circuit_breaker import CircuitBreakerRegistry
+from utils.rate_limit import SlidingWindowLimiter
+from utils.profiling import RequestProfiler
+from utils.now_playing import NowPlayingHub, StopPolling
+from utils.leaderboards import Leaderboards, DIMENSIONS, WINDOWS
+from utils.write_behind import WriteBehindQueue
 
 app = Flask(__name__)
 basedir = os.path.abspath(os.path.dirname(__file__))
 db_dir = os.path.join(basedir, 'database')
 os.makedirs(db_dir, exist_ok=True)
 db_path = os.path.join(db_dir, 'users.db')
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f'sqlite:///{db_path}')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'spotify-oauth-secret-key-change-in-production-' + secrets.token_hex(16))
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SESSION_PERMANENT'] = False
-app.config['SESSION_USE_SIGNER'] = True
-app.config['SESSION_KEY_PREFIX'] = 'spotify_oauth:'
-app.config['SESSION_COOKIE_NAME'] = 'spotify_session'
-app.config['SESSION_COOKIE_DOMAIN'] = None
-app.config['SESSION_COOKIE_PATH'] = '/'
-app.config['SESSION_COOKIE_HTTPONLY'] = True
-app.config['SESSION_COOKIE_SECURE'] = False
-app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+# SECRET_KEY signs every access and refresh token. Without a fixed key each
+# process makes up its own, so every restart (and every debug reloader cycle)
+# logs all users out and workers reject each other's tokens.
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+if not app.config['SECRET_KEY']:
+    app.config['SECRET_KEY'] = 'spotify-oauth-secret-key-change-in-production-' + secrets.token_hex(16)
+    print("⚠️" * 10)
+    print("⚠️ SECRET_KEY is not set: using a random key for this process only.")
+    print("⚠️ All tokens become invalid on restart; set SECRET_KEY before deploying.")
+    print("⚠️" * 10)
+app.config['ACCESS_TOKEN_TTL'] = int(os.environ.get('ACCESS_TOKEN_TTL', 900))
+app.config['REFRESH_TOKEN_TTL'] = int(os.environ.get('REFRESH_TOKEN_TTL', 14 * 24 * 3600))
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 10000))
+app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 30))
+app.config['SPOTIFY_CATALOG_SIZE'] = int(os.environ.get('SPOTIFY_CATALOG_SIZE', 50000))
+app.config['SPOTIFY_TIMEOUT'] = float(os.environ.get('SPOTIFY_TIMEOUT', 10))
+app.config['SPOTIFY_BREAKER_FAILURES'] = int(os.environ.get('SPOTIFY_BREAKER_FAILURES', 5))
+app.config['SPOTIFY_BREAKER_RESET'] = float(os.environ.get('SPOTIFY_BREAKER_RESET', 30))
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 64 * 1024))
+app.config['LOGIN_FAILURES_PER_ACCOUNT'] = int(os.environ.get('LOGIN_FAILURES_PER_ACCOUNT', 10))
+app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED', '0') == '1'
+app.config['PROFILING_SAMPLE_RATE'] = float(os.environ.get('PROFILING_SAMPLE_RATE', 0.0))
+app.config['PROFILING_TOKEN'] = os.environ.get('PROFILING_TOKEN')
+app.config['PROFILING_DIR'] = os.environ.get('PROFILING_DIR', os.path.join(basedir, 'profiles'))
+app.config['NOW_PLAYING_MIN_INTERVAL'] = float(os.environ.get('NOW_PLAYING_MIN_INTERVAL', 3))
+app.config['NOW_PLAYING_MAX_INTERVAL'] = float(os.environ.get('NOW_PLAYING_MAX_INTERVAL', 30))
+app.config['NOW_PLAYING_HEARTBEAT'] = float(os.environ.get('NOW_PLAYING_HEARTBEAT', 15))
+app.config['LEADERBOARD_SNAPSHOT_PATH'] = os.environ.get('LEADERBOARD_SNAPSHOT_PATH', os.path.join(db_dir, 'leaderboards.json'))
+app.config['LEADERBOARD_SNAPSHOT_INTERVAL'] = float(os.environ.get('LEADERBOARD_SNAPSHOT_INTERVAL', 60))
+app.config['WRITE_BEHIND_INTERVAL'] = float(os.environ.get('WRITE_BEHIND_INTERVAL', 0.005))
+app.config['WRITE_BEHIND_DURABILITY'] = os.environ.get('WRITE_BEHIND_DURABILITY', 'async')
 
 SPOTIFY_REDIRECT_URI = 'http://127.0.0.1:5000/api/spotify/callback'
-SPOTIFY_SCOPE = 'user-read-private user-read-email playlist-read-private playlist-read-collaborative user-top-read user-read-recently-played'
+SPOTIFY_ACCOUNTS_URL = os.environ.get('SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com')
+SPOTIFY_API_URL = os.environ.get('SPOTIFY_API_URL', 'https://api.spotify.com/v1')
+SPOTIFY_SCOPE = 'user-read-private user-read-email playlist-read-private playlist-read-collaborative user-top-read user-read-recently-played user-read-currently-playing'
+# Body size caps (bytes) for endpoints that take small JSON bodies; everything
+# else is capped by MAX_CONTENT_LENGTH
+ROUTE_BODY_LIMITS = {
+    'signup': 4 * 1024,
+    'login': 1024,
+    'refresh_access_token': 2 * 1024,
+    'update_user_profile': 4 * 1024
+}
+# Requests allowed per client IP per minute on the auth endpoints
+ROUTE_IP_LIMITS = {
+    'signup': 5,
+    'login': 20,
+    'refresh_access_token': 30
+}
+# Seconds a user's Spotify list is served from the catalog before refetching
+SPOTIFY_LIST_TTL = {
+    'playlists': 300,
+    'top-tracks': 600,
+    'top-artists': 600,
+    'recently-played': 30
+}
 
 print(f"📁 Database will be created at: {db_path}")
 
 db = SQLAlchemy(app)
 CORS(app, supports_credentials=True)
+token_signer = TokenSigner(
+    app.config['SECRET_KEY'],
+    access_ttl=app.config['ACCESS_TOKEN_TTL'],
+    refresh_ttl=app.config['REFRESH_TOKEN_TTL']
+)
+user_cache = IdentityCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+spotify_catalog = SpotifyCatalog(max_entities=app.config['SPOTIFY_CATALOG_SIZE'])
+leaderboards = Leaderboards()
+if app.config['LEADERBOARD_SNAPSHOT_PATH']:
+    if leaderboards.load(app.config['LEADERBOARD_SNAPSHOT_PATH']):
+        print(f"🏆 Leaderboards restored from {app.config['LEADERBOARD_SNAPSHOT_PATH']}")
+    leaderboards.start_snapshots(app.config['LEADERBOARD_SNAPSHOT_PATH'], app.config['LEADERBOARD_SNAPSHOT_INTERVAL'])
+    atexit.register(leaderboards.save_if_dirty, app.config['LEADERBOARD_SNAPSHOT_PATH'])
+spotify_breakers = CircuitBreakerRegistry(
+    failure_threshold=app.config['SPOTIFY_BREAKER_FAILURES'],
+    reset_timeout=app.config['SPOTIFY_BREAKER_RESET']
+)
+ip_limiters = {endpoint: SlidingWindowLimiter(limit, 60) for endpoint, limit in ROUTE_IP_LIMITS.items()}
+login_failures = SlidingWindowLimiter(app.config['LOGIN_FAILURES_PER_ACCOUNT'], 300)
+profiler = RequestProfiler(
+    app.config['PROFILING_DIR'],
+    enabled=app.config['PROFILING_ENABLED'],
+    sample_rate=app.config['PROFILING_SAMPLE_RATE'],
+    debug_token=app.config['PROFILING_TOKEN']
+)
 
 class SpotifyOAuthState(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -57,7 +137,31 @@ class SpotifyOAuthState(db.Model):
 
     def is_valid(self):
         return not self.used and not self.is_expired()
-class User(db.Model):
+class UserHelpers:
+    """Read-only helpers shared by User rows and cached UserSnapshots"""
+    __slots__ = ()
+
+    def get_genres(self):
+        """Convert genres JSON string back to list"""
+        if self.genres:
+            try:
+                return json.loads(self.genres)
+            except json.JSONDecodeError:
+                return []
+        return []
+
+    def is_spotify_token_valid(self):
+        """Check if Spotify token is still valid"""
+        if not self.spotify_token_expires_at:
+            return False
+        if self.spotify_token_expires_at.tzinfo is None:
+            expires_at_utc = self.spotify_token_expires_at.replace(tzinfo=timezone.utc)
+        else:
+            expires_at_utc = self.spotify_token_expires_at
+        
+        return datetime.now(timezone.utc) < expires_at_utc
+
+class User(UserHelpers, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -77,15 +181,6 @@ class User(db.Model):
     def __repr__(self):
         return f'<User {self.username}>'
     
-    def get_genres(self):
-        """Convert genres JSON string back to list"""
-        if self.genres:
-            try:
-                return json.loads(self.genres)
-            except json.JSONDecodeError:
-                return []
-        return []
-    
     def set_genres(self, genres_list):
         """Convert genres list to JSON string"""
         if genres_list:
@@ -93,16 +188,79 @@ class User(db.Model):
         else:
             self.genres = None
 
-    def is_spotify_token_valid(self):
-        """Check if Spotify token is still valid"""
-        if not self.spotify_token_expires_at:
-            return False
-        if self.spotify_token_expires_at.tzinfo is None:
-            expires_at_utc = self.spotify_token_expires_at.replace(tzinfo=timezone.utc)
-        else:
-            expires_at_utc = self.spotify_token_expires_at
-        
-        return datetime.now(timezone.utc) < expires_at_utc
+class UserSnapshot(UserHelpers):
+    """Compact, detached copy of the User fields read on hot paths"""
+    __slots__ = (
+        'id', 'username', 'email', 'password_hash', 'genres', 'profile_picture',
+        'created_at', 'spotify_connected', 'spotify_access_token',
+        'spotify_refresh_token', 'spotify_token_expires_at', 'spotify_display_name', 'spotify_email',
+        'spotify_profile_image'
+    )
+
+    def __init__(self, user):
+        for field in self.__slots__:
+            setattr(self, field, getattr(user, field))
+
+    def __repr__(self):
+        return f'<UserSnapshot {self.username}>'
+
+def with_pending_writes(snapshot):
+    """Overlay queued write-behind updates so callers read their own writes"""
+    pending = write_queue.pending(snapshot.id)
+    if not pending:
+        return snapshot
+    snapshot = UserSnapshot(snapshot)
+    for field, value in pending.items():
+        setattr(snapshot, field, value)
+    return snapshot
+
+def get_cached_user(user_id):
+    """Return a UserSnapshot by id, only reading SQLite on a cache miss"""
+    snapshot = user_cache.get(user_id)
+    if snapshot is None:
+        generation = user_cache.generation
+        user = db.session.get(User, user_id)
+        if not user:
+            return None
+        snapshot = user_cache.put(UserSnapshot(user), generation)
+    return with_pending_writes(snapshot)
+
+def get_cached_user_by(field, value):
+    """Return a UserSnapshot by username or email, only reading SQLite on a cache miss"""
+    snapshot = user_cache.get_by(field, value)
+    if snapshot is None:
+        generation = user_cache.generation
+        user = User.query.filter_by(**{field: value}).first()
+        if not user:
+            return None
+        snapshot = user_cache.put(UserSnapshot(user), generation)
+    return with_pending_writes(snapshot)
+
+def persist_user_updates(updates):
+    """Write a batch of queued User updates in a single transaction"""
+    with app.app_context():
+        try:
+            for user_id, fields in updates.items():
+                User.query.filter_by(id=user_id).update(fields)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+def invalidate_users(user_ids):
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+
+# Non-critical User updates (refreshed Spotify access tokens, Spotify display
+# metadata) are batched into shared commits instead of one commit each
+write_queue = WriteBehindQueue(
+    persist_user_updates,
+    interval=app.config['WRITE_BEHIND_INTERVAL'],
+    durability=app.config['WRITE_BEHIND_DURABILITY'],
+    on_commit=invalidate_users
+)
+write_queue.start()
+atexit.register(write_queue.stop)
 
 def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
@@ -130,10 +288,116 @@ def validate_genres(genres):
     
     return True
 
+def too_many_requests(retry_after):
+    response = jsonify({'error': 'Too many requests, please try again later'})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+@app.before_request
+def admit_request():
+    """Reject oversized bodies and over-limit clients before any body parsing"""
+    max_body = ROUTE_BODY_LIMITS.get(request.endpoint, app.config['MAX_CONTENT_LENGTH'])
+    if request.content_length is not None and request.content_length > max_body:
+        return jsonify({'error': 'Request body too large'}), 413
+    # A chunked body has no Content-Length to check up front; the capped
+    # routes take small JSON bodies that clients always send with a length
+    if (request.content_length is None and request.endpoint in ROUTE_BODY_LIMITS
+            and 'chunked' in request.headers.get('Transfer-Encoding', '').lower()):
+        return jsonify({'error': 'Content-Length required'}), 411
+    
+    limiter = ip_limiters.get(request.endpoint)
+    if limiter is not None:
+        allowed, retry_after = limiter.hit(request.remote_addr)
+        if not allowed:
+            print(f"🚫 Rate limited {request.remote_addr} on {request.endpoint}")
+            return too_many_requests(retry_after)
+
+@app.before_request
+def start_profiling():
+    """Profile a sampled fraction of requests, or any carrying the debug header"""
+    handle = profiler.start(request.headers.get('X-Debug-Profile'))
+    if handle is not None:
+        g.profile = handle
+
+@app.teardown_request
+def finish_profiling(exc):
+    handle = g.pop('profile', None)
+    if handle is not None:
+        name = profiler.finish(handle, request.endpoint)
+        if name:
+            print(f"⏱️ Profiled {request.method} {request.path} -> {name}")
+
+def require_auth(f):
+    """Authenticate the caller from a signed Bearer token without any DB lookup.
+
+    Sets g.user_id from the token claims. The token's ``sc`` claim is not
+    exposed: it is fixed when the token is issued and goes stale as soon as
+    Spotify is connected or disconnected, so routes decide from the cached
+    user row instead.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        auth_header = request.headers.get('Authorization', '')
+        if not auth_header.startswith('Bearer '):
+            return jsonify({'error': 'Authorization token is required'}), 401
+        
+        try:
+            claims = token_signer.verify(auth_header[len('Bearer '):])
+        except TokenError as e:
+            return jsonify({'error': str(e)}), 401
+        
+        g.user_id = claims['sub']
+        return f(*args, **kwargs)
+    return decorated
+
+class SpotifyUnavailable(requests.exceptions.ConnectionError):
+    """Raised without calling Spotify while that host's circuit is open"""
+
+def spotify_request(method, url, **kwargs):
+    """Call Spotify through the circuit breaker for the URL's host.
+
+    Timeouts, connection errors, 5xx and 429 responses count as failures,
+    as does anything else that interrupts the call, so a half-open probe
+    always reports back. Once a host's circuit opens, calls fail fast with SpotifyUnavailable
+    instead of tying up a worker for the full timeout.
+    """
+    breaker = spotify_breakers.get(urllib.parse.urlsplit(url).netloc)
+    if not breaker.allow_request():
+        raise SpotifyUnavailable(f'Spotify circuit open for {breaker.name}')
+    
+    kwargs.setdefault('timeout', app.config['SPOTIFY_TIMEOUT'])
+    try:
+        response = requests.request(method, url, **kwargs)
+    except BaseException:
+        breaker.record_failure()
+        raise
+    
+    if response.status_code >= 500 or response.status_code == 429:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+def stale_spotify_response(key, list_key, error, status):
+    """Serve an expired catalog copy when Spotify can't answer, otherwise the error"""
+    stale = spotify_catalog.hydrate_list(list_key, allow_stale=True)
+    if stale is not None:
+        return jsonify({key: stale, 'stale': True}), 200
+    return jsonify({'error': error}), status
+
 def refresh_spotify_token(user):
-    """Refresh Spotify access token using refresh token"""
-    if not user.spotify_refresh_token:
-        return False
+    """Refresh Spotify access token using refresh token.
+
+    Accepts a User row or a UserSnapshot and returns a fresh UserSnapshot,
+    or None if the token could not be refreshed. Raises SpotifyUnavailable
+    while the accounts host's circuit is open, so callers can answer 503
+    (with stale data) instead of an auth error. The new access token goes
+    through the write-behind queue; a rotated refresh token is waited on,
+    since losing it would disconnect the account.
+    """
+    user = get_cached_user(user.id)
+    if not user or not user.spotify_refresh_token:
+        return None
     
     auth_header = base64.b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()).decode()
     
@@ -148,22 +412,72 @@ def refresh_spotify_token(user):
     }
     
     try:
-        response = requests.post('https://accounts.spotify.com/api/token', headers=headers, data=data)
+        response = spotify_request('POST', f'{SPOTIFY_ACCOUNTS_URL}/api/token', headers=headers, data=data)
         if response.status_code == 200:
             token_data = response.json()
-            user.spotify_access_token = token_data['access_token']
-            user.spotify_token_expires_at = datetime.now(timezone.utc) + timedelta(seconds=token_data['expires_in'])
+            fields = {
+                'spotify_access_token': token_data['access_token'],
+                'spotify_token_expires_at': datetime.now(timezone.utc) + timedelta(seconds=token_data['expires_in'])
+            }
             
             # Update refresh token if provided
             if 'refresh_token' in token_data:
-                user.spotify_refresh_token = token_data['refresh_token']
-            
-            db.session.commit()
-            return True
+                fields['spotify_refresh_token'] = token_data['refresh_token']
+                write_queue.submit(user.id, fields, durability='group')
+            else:
+                write_queue.submit(user.id, fields)
+            return get_cached_user(user.id)
+    except SpotifyUnavailable:
+        raise
     except Exception as e:
         print(f"❌ Error refreshing Spotify token: {e}")
     
-    return False
+    return None
+
+def spotify_fetch_many(access_token):
+    """Build a fetch_many(kind, ids) callable for Spotify's multi-ID endpoints"""
+    def fetch_many(kind, ids):
+        try:
+            response = spotify_request(
+                'GET',
+                f'{SPOTIFY_API_URL}/{kind}',
+                params={'ids': ','.join(ids)},
+                headers={'Authorization': f'Bearer {access_token}'}
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Request error bulk fetching {kind}: {e}")
+            return []
+        
+        if response.status_code != 200:
+            print(f"❌ Spotify API Error bulk fetching {kind} - Status: {response.status_code}")
+            return []
+        return response.json().get(kind, [])
+    return fetch_many
+
+def record_top_tracks(user_id, tracks):
+    """Feed a user's synced top tracks (and their artists) into the leaderboards"""
+    artists = [artist for track in tracks for artist in track.get('artists') or []]
+    leaderboards.update(
+        user_id,
+        'top_tracks',
+        {'tracks': [t.get('id') for t in tracks], 'artists': [a.get('id') for a in artists]},
+        labels={
+            'tracks': {t.get('id'): t.get('name') for t in tracks},
+            'artists': {a.get('id'): a.get('name') for a in artists}
+        }
+    )
+
+def record_top_artists(user_id, artists):
+    """Feed a user's synced top artists and their genres into the leaderboards"""
+    leaderboards.update(
+        user_id,
+        'top_artists',
+        {
+            'artists': [a.get('id') for a in artists],
+            'genres': [genre for a in artists for genre in a.get('genres') or []]
+        },
+        labels={'artists': {a.get('id'): a.get('name') for a in artists}}
+    )
 
 def get_spotify_user_data(access_token):
     """Get user data from Spotify API with enhanced error handling"""
@@ -171,7 +485,7 @@ def get_spotify_user_data(access_token):
     
     try:
         print(f"🔍 Making request to Spotify API with token: {access_token[:20]}...")
-        response = requests.get('https://api.spotify.com/v1/me', headers=headers, timeout=10)
+        response = spotify_request('GET', f'{SPOTIFY_API_URL}/me', headers=headers)
         
         print(f"📊 Spotify API Response Status: {response.status_code}")
         print(f"📊 Spotify API Response Headers: {dict(response.headers)}")
@@ -208,192 +522,332 @@ def get_spotify_user_data(access_token):
         return None
     
 @app.route('/api/spotify/playlists', methods=['POST'])
+@require_auth
 def get_spotify_playlists():
     """Get user's Spotify playlists"""
     try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        
-        if not user_id:
-            return jsonify({'error': 'User ID is required'}), 400
-        
-        user = db.session.get(User, user_id)
+        user = get_cached_user(g.user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
         if not user.spotify_connected:
             return jsonify({'error': 'Spotify not connected'}), 400
+        list_key = (user.id, 'playlists')
         if not user.is_spotify_token_valid():
-            if not refresh_spotify_token(user):
+            try:
+                user = refresh_spotify_token(user)
+            except SpotifyUnavailable as e:
+                print(f"⚡ {e} - failing fast")
+                return stale_spotify_response('playlists', list_key, 'Spotify is temporarily unavailable', 503)
+            if not user:
                 return jsonify({'error': 'Failed to refresh Spotify token'}), 401
         
         headers = {'Authorization': f'Bearer {user.spotify_access_token}'}
         
+        cached = spotify_catalog.hydrate_list(list_key, spotify_fetch_many(user.spotify_access_token))
+        if cached is not None:
+            return jsonify({'playlists': cached}), 200
+        
         try:
-            response = requests.get(
-                'https://api.spotify.com/v1/me/playlists?limit=50', 
-                headers=headers, 
-                timeout=10
+            response = spotify_request(
+                'GET',
+                f'{SPOTIFY_API_URL}/me/playlists?limit=50',
+                headers=headers
             )
             
             if response.status_code == 200:
                 playlists_data = response.json()
+                spotify_catalog.store_list(list_key, 'playlists', playlists_data, SPOTIFY_LIST_TTL['playlists'])
                 return jsonify({'playlists': playlists_data}), 200
             else:
                 print(f"❌ Spotify API Error - Status: {response.status_code}")
+                if response.status_code >= 500 or response.status_code == 429:
+                    return stale_spotify_response('playlists', list_key, 'Failed to fetch playlists', 500)
                 return jsonify({'error': 'Failed to fetch playlists'}), 500
                 
+        except SpotifyUnavailable as e:
+            print(f"⚡ {e} - failing fast")
+            return stale_spotify_response('playlists', list_key, 'Spotify is temporarily unavailable', 503)
         except requests.exceptions.RequestException as e:
             print(f"❌ Request error getting playlists: {e}")
-            return jsonify({'error': 'Network error'}), 500
+            return stale_spotify_response('playlists', list_key, 'Network error', 500)
         
     except Exception as e:
         print(f"❌ Error getting Spotify playlists: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/spotify/top-tracks', methods=['POST'])
+@require_auth
 def get_spotify_top_tracks():
     """Get user's top tracks"""
     try:
-        data = request.get_json()
-        user_id = data.get('user_id')
+        data = request.get_json(silent=True) or {}
         time_range = data.get('time_range', 'medium_term')  # short_term, medium_term, long_term
         limit = data.get('limit', 20)
         
-        if not user_id:
-            return jsonify({'error': 'User ID is required'}), 400
-        
-        user = db.session.get(User, user_id)
+        user = get_cached_user(g.user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
         if not user.spotify_connected:
             return jsonify({'error': 'Spotify not connected'}), 400
+        list_key = (user.id, 'top-tracks', time_range, limit)
         if not user.is_spotify_token_valid():
-            if not refresh_spotify_token(user):
+            try:
+                user = refresh_spotify_token(user)
+            except SpotifyUnavailable as e:
+                print(f"⚡ {e} - failing fast")
+                return stale_spotify_response('top_tracks', list_key, 'Spotify is temporarily unavailable', 503)
+            if not user:
                 return jsonify({'error': 'Failed to refresh Spotify token'}), 401
         
         headers = {'Authorization': f'Bearer {user.spotify_access_token}'}
         
+        cached = spotify_catalog.hydrate_list(list_key, spotify_fetch_many(user.spotify_access_token))
+        if cached is not None:
+            return jsonify({'top_tracks': cached}), 200
+        
         try:
-            response = requests.get(
-                f'https://api.spotify.com/v1/me/top/tracks?time_range={time_range}&limit={limit}', 
-                headers=headers, 
-                timeout=10
+            response = spotify_request(
+                'GET',
+                f'{SPOTIFY_API_URL}/me/top/tracks?time_range={time_range}&limit={limit}',
+                headers=headers
             )
             
             if response.status_code == 200:
                 top_tracks_data = response.json()
+                spotify_catalog.store_list(list_key, 'tracks', top_tracks_data, SPOTIFY_LIST_TTL['top-tracks'])
+                if time_range == 'medium_term':
+                    record_top_tracks(user.id, top_tracks_data.get('items') or [])
                 return jsonify({'top_tracks': top_tracks_data}), 200
             else:
                 print(f"❌ Spotify API Error - Status: {response.status_code}")
+                if response.status_code >= 500 or response.status_code == 429:
+                    return stale_spotify_response('top_tracks', list_key, 'Failed to fetch top tracks', 500)
                 return jsonify({'error': 'Failed to fetch top tracks'}), 500
                 
+        except SpotifyUnavailable as e:
+            print(f"⚡ {e} - failing fast")
+            return stale_spotify_response('top_tracks', list_key, 'Spotify is temporarily unavailable', 503)
         except requests.exceptions.RequestException as e:
             print(f"❌ Request error getting top tracks: {e}")
-            return jsonify({'error': 'Network error'}), 500
+            return stale_spotify_response('top_tracks', list_key, 'Network error', 500)
         
     except Exception as e:
         print(f"❌ Error getting Spotify top tracks: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/spotify/recently-played', methods=['POST'])
+@require_auth
 def get_spotify_recently_played():
     """Get user's recently played tracks"""
     try:
-        data = request.get_json()
-        user_id = data.get('user_id')
+        data = request.get_json(silent=True) or {}
         limit = data.get('limit', 20)
         
-        if not user_id:
-            return jsonify({'error': 'User ID is required'}), 400
-        
-        user = db.session.get(User, user_id)
+        user = get_cached_user(g.user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
         if not user.spotify_connected:
             return jsonify({'error': 'Spotify not connected'}), 400
+        list_key = (user.id, 'recently-played', limit)
         if not user.is_spotify_token_valid():
-            if not refresh_spotify_token(user):
+            try:
+                user = refresh_spotify_token(user)
+            except SpotifyUnavailable as e:
+                print(f"⚡ {e} - failing fast")
+                return stale_spotify_response('recently_played', list_key, 'Spotify is temporarily unavailable', 503)
+            if not user:
                 return jsonify({'error': 'Failed to refresh Spotify token'}), 401
         
         headers = {'Authorization': f'Bearer {user.spotify_access_token}'}
         
+        cached = spotify_catalog.hydrate_list(list_key, spotify_fetch_many(user.spotify_access_token))
+        if cached is not None:
+            return jsonify({'recently_played': cached}), 200
+        
         try:
-            response = requests.get(
-                f'https://api.spotify.com/v1/me/player/recently-played?limit={limit}', 
-                headers=headers, 
-                timeout=10
+            response = spotify_request(
+                'GET',
+                f'{SPOTIFY_API_URL}/me/player/recently-played?limit={limit}',
+                headers=headers
             )
             
             if response.status_code == 200:
                 recently_played_data = response.json()
+                spotify_catalog.store_list(list_key, 'plays', recently_played_data, SPOTIFY_LIST_TTL['recently-played'])
                 return jsonify({'recently_played': recently_played_data}), 200
             else:
                 print(f"❌ Spotify API Error - Status: {response.status_code}")
+                if response.status_code >= 500 or response.status_code == 429:
+                    return stale_spotify_response('recently_played', list_key, 'Failed to fetch recently played tracks', 500)
                 return jsonify({'error': 'Failed to fetch recently played tracks'}), 500
                 
+        except SpotifyUnavailable as e:
+            print(f"⚡ {e} - failing fast")
+            return stale_spotify_response('recently_played', list_key, 'Spotify is temporarily unavailable', 503)
         except requests.exceptions.RequestException as e:
             print(f"❌ Request error getting recently played: {e}")
-            return jsonify({'error': 'Network error'}), 500
+            return stale_spotify_response('recently_played', list_key, 'Network error', 500)
         
     except Exception as e:
         print(f"❌ Error getting Spotify recently played: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/spotify/top-artists', methods=['POST'])
+@require_auth
 def get_spotify_top_artists():
     """Get user's top artists"""
     try:
-        data = request.get_json()
-        user_id = data.get('user_id')
+        data = request.get_json(silent=True) or {}
         time_range = data.get('time_range', 'medium_term')  # short_term, medium_term, long_term
         limit = data.get('limit', 20)
         
-        if not user_id:
-            return jsonify({'error': 'User ID is required'}), 400
-        
-        user = db.session.get(User, user_id)
+        user = get_cached_user(g.user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
         if not user.spotify_connected:
             return jsonify({'error': 'Spotify not connected'}), 400
+        list_key = (user.id, 'top-artists', time_range, limit)
         if not user.is_spotify_token_valid():
-            if not refresh_spotify_token(user):
+            try:
+                user = refresh_spotify_token(user)
+            except SpotifyUnavailable as e:
+                print(f"⚡ {e} - failing fast")
+                return stale_spotify_response('top_artists', list_key, 'Spotify is temporarily unavailable', 503)
+            if not user:
                 return jsonify({'error': 'Failed to refresh Spotify token'}), 401
         
         headers = {'Authorization': f'Bearer {user.spotify_access_token}'}
         
+        cached = spotify_catalog.hydrate_list(list_key, spotify_fetch_many(user.spotify_access_token))
+        if cached is not None:
+            return jsonify({'top_artists': cached}), 200
+        
         try:
-            response = requests.get(
-                f'https://api.spotify.com/v1/me/top/artists?time_range={time_range}&limit={limit}', 
-                headers=headers, 
-                timeout=10
+            response = spotify_request(
+                'GET',
+                f'{SPOTIFY_API_URL}/me/top/artists?time_range={time_range}&limit={limit}',
+                headers=headers
             )
             
             if response.status_code == 200:
                 top_artists_data = response.json()
+                spotify_catalog.store_list(list_key, 'artists', top_artists_data, SPOTIFY_LIST_TTL['top-artists'])
+                if time_range == 'medium_term':
+                    record_top_artists(user.id, top_artists_data.get('items') or [])
                 return jsonify({'top_artists': top_artists_data}), 200
             else:
                 print(f"❌ Spotify API Error - Status: {response.status_code}")
+                if response.status_code >= 500 or response.status_code == 429:
+                    return stale_spotify_response('top_artists', list_key, 'Failed to fetch top artists', 500)
                 return jsonify({'error': 'Failed to fetch top artists'}), 500
                 
+        except SpotifyUnavailable as e:
+            print(f"⚡ {e} - failing fast")
+            return stale_spotify_response('top_artists', list_key, 'Spotify is temporarily unavailable', 503)
         except requests.exceptions.RequestException as e:
             print(f"❌ Request error getting top artists: {e}")
-            return jsonify({'error': 'Network error'}), 500
+            return stale_spotify_response('top_artists', list_key, 'Network error', 500)
         
     except Exception as e:
         print(f"❌ Error getting Spotify top artists: {e}")
         return jsonify({'error': 'Internal server error'}), 500
+def compact_track(track):
+    """The few track fields the now playing stream sends"""
+    images = (track.get('album') or {}).get('images') or []
+    return {
+        'id': track.get('id'),
+        'name': track.get('name'),
+        'artists': [artist.get('name') for artist in track.get('artists') or []],
+        'album': (track.get('album') or {}).get('name'),
+        'image': images[0]['url'] if images else None
+    }
+
+def fetch_now_playing(user_id):
+    """Poll Spotify once for a user's current playback and most recent play"""
+    with app.app_context():
+        user = get_cached_user(user_id)
+        if not user or not user.spotify_connected:
+            raise StopPolling('spotify_disconnected')
+        if not user.is_spotify_token_valid():
+            user = refresh_spotify_token(user)
+            if not user:
+                raise RuntimeError('Failed to refresh Spotify token')
+        
+        headers = {'Authorization': f'Bearer {user.spotify_access_token}'}
+        playing = spotify_request('GET', f'{SPOTIFY_API_URL}/me/player/currently-playing', headers=headers)
+        recent = spotify_request('GET', f'{SPOTIFY_API_URL}/me/player/recently-played?limit=1', headers=headers)
+        playing.raise_for_status()
+        recent.raise_for_status()
+    
+    state = {'is_playing': False, 'track': None, 'progress_ms': None, 'remaining_ms': None, 'last_played': None}
+    if playing.status_code == 200 and playing.content:
+        playback = playing.json()
+        item = playback.get('item')
+        if item:
+            state['is_playing'] = bool(playback.get('is_playing'))
+            state['track'] = compact_track(item)
+            state['progress_ms'] = playback.get('progress_ms')
+            if item.get('duration_ms') is not None and playback.get('progress_ms') is not None:
+                state['remaining_ms'] = max(0, item['duration_ms'] - playback['progress_ms'])
+    
+    plays = recent.json().get('items') or []
+    if plays:
+        state['last_played'] = {
+            'track': compact_track(plays[0]['track']),
+            'played_at': plays[0].get('played_at')
+        }
+    return state
+
+now_playing_hub = NowPlayingHub(
+    fetch_now_playing,
+    min_interval=app.config['NOW_PLAYING_MIN_INTERVAL'],
+    max_interval=app.config['NOW_PLAYING_MAX_INTERVAL']
+)
+
+@app.route('/api/spotify/now-playing/stream', methods=['GET'])
+@require_auth
+def stream_now_playing():
+    """Server-sent events stream of playback and recent-play changes.
+
+    All of a user's open streams share one poller in now_playing_hub. Once
+    Spotify is disconnected the poller stops and every stream gets a final
+    ``end`` event before it closes.
+    """
+    user = get_cached_user(g.user_id)
+    if not user or not user.spotify_connected:
+        return jsonify({'error': 'Spotify not connected'}), 400
+    
+    now_playing_hub.start()
+    subscription = now_playing_hub.subscribe(g.user_id)
+    heartbeat = app.config['NOW_PLAYING_HEARTBEAT']
+    
+    def events():
+        yield 'retry: 5000\n\n'
+        while True:
+            state = subscription.wait(heartbeat)
+            if subscription.closed is not None:
+                yield f'event: end\ndata: {json.dumps({"reason": subscription.closed})}\n\n'
+                return
+            if state is None:
+                yield ': keep-alive\n\n'
+            else:
+                yield f'event: now_playing\ndata: {json.dumps(state)}\n\n'
+    
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(lambda: now_playing_hub.unsubscribe(subscription))
+    return response
+
 @app.route('/api/signup', methods=['POST'])
 def signup():
     try:
         data = request.get_json()
         
-        print(f"📦 Signup - Raw request data: {data}")
-        
         if not data:
             print("❌ No data provided")
             return jsonify({'error': 'No data provided'}), 400
@@ -407,7 +861,6 @@ def signup():
         print(f"📝 Parsed signup data:")
         print(f"   Username: '{username}' (length: {len(username)})")
         print(f"   Email: '{email}'")
-        print(f"   Password: '{password}' (length: {len(password)})")
         print(f"   Genres: {genres} (count: {len(genres) if genres else 0})")
         print(f"   Profile Picture: {profile_picture[:50] + '...' if profile_picture and len(profile_picture) > 50 else profile_picture}")
         if not username or len(username) < 3:
@@ -426,12 +879,12 @@ def signup():
             return jsonify({'error': 'Invalid genres selection (1-5 valid genres required)'}), 400
         
         print("✅ All signup validations passed!")
-        existing_user = User.query.filter_by(username=username).first()
+        existing_user = get_cached_user_by('username', username)
         if existing_user:
             print(f"❌ Username already exists: {username}")
             return jsonify({'error': 'Username already exists'}), 400
         
-        existing_email = User.query.filter_by(email=email).first()
+        existing_email = get_cached_user_by('email', email)
         if existing_email:
             print(f"❌ Email already exists: {email}")
             return jsonify({'error': 'Email already registered'}), 400
@@ -447,11 +900,13 @@ def signup():
         
         db.session.add(new_user)
         db.session.commit()
+        leaderboards.update(new_user.id, 'profile', {'genres': new_user.get_genres()})
         
         print(f"✅ User created successfully: {username}")
         
         return jsonify({
             'message': 'User created successfully',
+            **token_signer.issue_pair(new_user.id, new_user.spotify_connected),
             'user': {
                 'id': new_user.id,
                 'username': new_user.username,
@@ -474,8 +929,6 @@ def login():
     try:
         data = request.get_json()
         
-        print(f"📦 Login - Raw request data: {data}")
-        
         if not data:
             print("❌ No login data provided")
             return jsonify({'error': 'No data provided'}), 400
@@ -484,7 +937,6 @@ def login():
         
         print(f"📝 Login attempt:")
         print(f"   Login field: '{login_field}'")
-        print(f"   Password: '{password}' (length: {len(password)})")
         
         if not login_field:
             print("❌ No username/email provided")
@@ -493,25 +945,37 @@ def login():
         if not password:
             print("❌ No password provided")
             return jsonify({'error': 'Password is required'}), 400
+        
+        # Throttle per account before paying for check_password_hash
+        account_key = login_field.lower()
+        allowed, retry_after = login_failures.check(account_key)
+        if not allowed:
+            print(f"🚫 Too many failed logins for: {login_field}")
+            return too_many_requests(retry_after)
+        
         user = None
         if validate_email(login_field):
-            user = User.query.filter_by(email=login_field.lower()).first()
+            user = get_cached_user_by('email', login_field.lower())
             print(f"🔍 Looking for user by email: {login_field.lower()}")
         else:
-            user = User.query.filter_by(username=login_field).first()
+            user = get_cached_user_by('username', login_field)
             print(f"🔍 Looking for user by username: {login_field}")
         
         if not user:
             print(f"❌ User not found: {login_field}")
+            login_failures.add(account_key)
             return jsonify({'error': 'Invalid username/email or password'}), 401
         if not check_password_hash(user.password_hash, password):
             print(f"❌ Invalid password for user: {user.username}")
+            login_failures.add(account_key)
             return jsonify({'error': 'Invalid username/email or password'}), 401
         
         print(f"✅ Login successful for user: {user.username}")
+        login_failures.reset(account_key)
         
         return jsonify({
             'message': 'Login successful',
+            **token_signer.issue_pair(user.id, user.spotify_connected),
             'user': {
                 'id': user.id,
                 'username': user.username,
@@ -528,17 +992,40 @@ def login():
     except Exception as e:
         print(f"❌ Error during login: {e}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/api/token/refresh', methods=['POST'])
+def refresh_access_token():
+    """Rotate a refresh token into a new access/refresh token pair"""
+    try:
+        data = request.get_json(silent=True) or {}
+        refresh_token = data.get('refresh_token')
+        
+        if not refresh_token:
+            return jsonify({'error': 'Refresh token is required'}), 400
+        
+        try:
+            claims = token_signer.rotate(refresh_token)
+        except TokenError as e:
+            return jsonify({'error': str(e)}), 401
+        
+        # Re-read the user so a rotated token picks up Spotify (dis)connects
+        user = get_cached_user(claims['sub'])
+        if not user:
+            return jsonify({'error': 'User not found'}), 401
+        
+        return jsonify(token_signer.issue_pair(user.id, user.spotify_connected)), 200
+        
+    except Exception as e:
+        print(f"❌ Error refreshing access token: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
 @app.route('/api/spotify/auth-url', methods=['POST'])
+@require_auth
 def get_spotify_auth_url():
     """Generate Spotify authorization URL"""
     try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        
-        if not user_id:
-            return jsonify({'error': 'User ID is required'}), 400
+        user_id = g.user_id
         
-        user = db.session.get(User, user_id)  # Fixed SQLAlchemy syntax
+        user = get_cached_user(user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
         SpotifyOAuthState.query.filter_by(user_id=user_id, used=False).delete()
@@ -560,7 +1047,7 @@ def get_spotify_auth_url():
             'state': f"{user_id}:{state_token}"
         }
         
-        auth_url = 'https://accounts.spotify.com/authorize?' + urllib.parse.urlencode(params)
+        auth_url = f'{SPOTIFY_ACCOUNTS_URL}/authorize?' + urllib.parse.urlencode(params)
         
         return jsonify({
             'auth_url': auth_url,
@@ -599,6 +1086,8 @@ def spotify_callback():
             print(f"❌ Invalid state parameter format: {state}. Error: {e}")
             return redirect('http://localhost:3000/spotify-error')
         
+        # Let queued updates land first so they can't overwrite this connect
+        write_queue.flush()
         user = db.session.get(User, user_id)
         if not user:
             print(f"❌ User not found: {user_id}")
@@ -634,10 +1123,9 @@ def spotify_callback():
         print(f"🔍 Request data: {data}")
         
         try:
-            response = requests.post('https://accounts.spotify.com/api/token', 
-                                   headers=headers, 
-                                   data=data, 
-                                   timeout=10)
+            response = spotify_request('POST', f'{SPOTIFY_ACCOUNTS_URL}/api/token',
+                                       headers=headers,
+                                       data=data)
             
             print(f"📊 Token exchange response status: {response.status_code}")
             print(f"📊 Token exchange response headers: {dict(response.headers)}")
@@ -656,6 +1144,9 @@ def spotify_callback():
             
             print(f"✅ Token exchange successful - expires in {expires_in} seconds")
             
+        except SpotifyUnavailable as e:
+            print(f"⚡ {e} - failing fast")
+            return redirect('http://localhost:3000/spotify-error?reason=spotify_unavailable')
         except requests.exceptions.Timeout:
             print("❌ Timeout during token exchange")
             return redirect('http://localhost:3000/spotify-error')
@@ -672,6 +1163,7 @@ def spotify_callback():
             user.spotify_token_expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
             user.spotify_connected = True
             db.session.commit()
+            user_cache.invalidate(user.id)
             print("⚠️ Saved tokens despite user data failure")
             return redirect('http://localhost:3000/spotify-error?reason=user_data_failed')
         
@@ -685,13 +1177,19 @@ def spotify_callback():
         user.spotify_refresh_token = refresh_token
         user.spotify_token_expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
         user.spotify_connected = True
-        user.spotify_display_name = spotify_user_data.get('display_name')
-        user.spotify_email = spotify_user_data.get('email')
-        if spotify_user_data.get('images') and len(spotify_user_data['images']) > 0:
-            user.spotify_profile_image = spotify_user_data['images'][0]['url']
-            print(f"✅ Profile image saved: {user.spotify_profile_image}")
         
         db.session.commit()
+        user_cache.invalidate(user.id)
+        spotify_catalog.invalidate_user(user.id)
+        
+        display_fields = {
+            'spotify_display_name': spotify_user_data.get('display_name'),
+            'spotify_email': spotify_user_data.get('email')
+        }
+        if spotify_user_data.get('images') and len(spotify_user_data['images']) > 0:
+            display_fields['spotify_profile_image'] = spotify_user_data['images'][0]['url']
+            print(f"✅ Profile image saved: {display_fields['spotify_profile_image']}")
+        write_queue.submit(user.id, display_fields)
         
         print(f"✅ Spotify connected successfully for user: {user.username}")
         return redirect('http://localhost:3000/spotify-success')
@@ -703,16 +1201,13 @@ def spotify_callback():
         return redirect('http://localhost:3000/spotify-error?reason=callback_error')
     
 @app.route('/api/spotify/disconnect', methods=['POST'])
+@require_auth
 def disconnect_spotify():
     """Disconnect Spotify account"""
     try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        
-        if not user_id:
-            return jsonify({'error': 'User ID is required'}), 400
-        
-        user = db.session.get(User, user_id)
+        # Let queued token or display updates land first so they can't undo this
+        write_queue.flush()
+        user = db.session.get(User, g.user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
         user.spotify_id = None
@@ -725,31 +1220,37 @@ def disconnect_spotify():
         user.spotify_profile_image = None
         
         db.session.commit()
+        user_cache.invalidate(user.id)
+        spotify_catalog.invalidate_user(user.id)
+        leaderboards.remove(user.id, ('top_tracks', 'top_artists'))
         
-        return jsonify({'message': 'Spotify account disconnected successfully'}), 200
+        return jsonify({
+            'message': 'Spotify account disconnected successfully',
+            **token_signer.issue_pair(user.id, False)
+        }), 200
         
     except Exception as e:
         print(f"❌ Error disconnecting Spotify: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/spotify/user-data', methods=['POST'])
+@require_auth
 def get_spotify_user_data_endpoint():
     """Get current user's Spotify data"""
     try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        
-        if not user_id:
-            return jsonify({'error': 'User ID is required'}), 400
-        
-        user = db.session.get(User, user_id)
+        user = get_cached_user(g.user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
         if not user.spotify_connected:
             return jsonify({'error': 'Spotify not connected'}), 400
         if not user.is_spotify_token_valid():
-            if not refresh_spotify_token(user):
+            try:
+                user = refresh_spotify_token(user)
+            except SpotifyUnavailable as e:
+                print(f"⚡ {e} - failing fast")
+                return jsonify({'error': 'Spotify is temporarily unavailable'}), 503
+            if not user:
                 return jsonify({'error': 'Failed to refresh Spotify token'}), 401
         spotify_data = get_spotify_user_data(user.spotify_access_token)
         if not spotify_data:
@@ -788,13 +1289,56 @@ def get_users():
         print(f"❌ Error getting users: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/leaderboards/<dimension>', methods=['GET'])
+def get_leaderboard(dimension):
+    """Top genres, artists or tracks across all nowNoise users"""
+    if dimension not in DIMENSIONS:
+        return jsonify({'error': f"Unknown leaderboard, expected one of: {', '.join(DIMENSIONS)}"}), 404
+    
+    window = request.args.get('window', 'week')
+    if window not in WINDOWS:
+        return jsonify({'error': f"Invalid window, expected one of: {', '.join(WINDOWS)}"}), 400
+    
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    
+    return jsonify({
+        'dimension': dimension,
+        'window': window,
+        'entries': leaderboards.top(dimension, window, limit)
+    }), 200
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'message': 'Backend is running!'})
+    return jsonify({
+        'status': 'healthy',
+        'message': 'Backend is running!',
+        'spotify_circuits': spotify_breakers.states()
+    })
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def list_profiles():
+    """List recent request profiles (requires the profiling debug token)"""
+    if not profiler.is_authorized(request.headers.get('X-Debug-Profile')):
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify({'profiles': profiler.list_profiles()}), 200
+
+@app.route('/api/admin/profiles/<filename>', methods=['GET'])
+def download_profile(filename):
+    """Download a .pstats or .folded profile file"""
+    if not profiler.is_authorized(request.headers.get('X-Debug-Profile')):
+        return jsonify({'error': 'Not found'}), 404
+    path = profiler.path_for(filename)
+    if not path:
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(path, as_attachment=True, download_name=filename)
 
 @app.route('/api/users/<int:user_id>/profile', methods=['PUT'])
+@require_auth
 def update_user_profile(user_id):
     try:
+        if user_id != g.user_id:
+            return jsonify({'error': 'Cannot update another user\'s profile'}), 403
+        
         data = request.get_json()
         
         user = db.session.get(User, user_id)
@@ -810,6 +1354,9 @@ def update_user_profile(user_id):
             user.profile_picture = data['profilePicture']
         
         db.session.commit()
+        user_cache.invalidate(user.id)
+        if 'genres' in data:
+            leaderboards.update(user.id, 'profile', {'genres': user.get_genres()})
         
         return jsonify({
             'message': 'Profile updated successfully',
@@ -848,13 +1395,18 @@ if __name__ == '__main__':
     print("📍 API Endpoints:")
     print("   POST /api/signup - Create new user")
     print("   POST /api/login - Login user")
+    print("   POST /api/token/refresh - Rotate refresh token")
     print("   GET  /api/users - Get all users")
+    print("   GET  /api/leaderboards/<genres|artists|tracks> - Global leaderboards")
     print("   PUT  /api/users/<id>/profile - Update user profile")
+    print("   GET  /api/admin/profiles - List request profiles (debug token)")
     print("   POST /api/spotify/auth-url - Get Spotify authorization URL")
     print("   GET  /api/spotify/callback - Spotify OAuth callback")
     print("   POST /api/spotify/disconnect - Disconnect Spotify")
     print("   POST /api/spotify/user-data - Get Spotify user data")
+    print("   GET  /api/spotify/now-playing/stream - Now playing (server-sent events)")
     print("🔗 CORS enabled for React Native")
     print("🎵 Spotify integration enabled")
+    print("💡 This dev server uses a thread per request; for many open streams run: gunicorn app:app (see gunicorn.conf.py)")
     
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,137 @@
+"""Commits per second under a token refresh storm, with and without write-behind.
+
+Runs the same mixed load twice against a file-backed SQLite database:
+refresher threads write new Spotify access tokens while one client keeps
+signing up new users. Each refresh first sleeps for ``--upstream-ms`` to
+stand in for the Spotify token round trip. In 'direct' mode every token update commits on its
+own, the way refresh_spotify_token used to; in 'write-behind' mode they go
+through app.write_queue.
+
+    python benchmarks/write_behind.py [--seconds 5] [--refreshers 8] [--users 200] [--upstream-ms 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+_db_dir = tempfile.mkdtemp(prefix='nownoise-bench-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+os.environ.setdefault('SECRET_KEY', 'bench-secret-key')
+os.environ['LEADERBOARD_SNAPSHOT_PATH'] = ''
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import event  # noqa: E402
+
+import app as app_module  # noqa: E402
+from app import app, db, User, ip_limiters  # noqa: E402
+
+
+def token_fields(n):
+    return {
+        'spotify_access_token': f'token-{n}',
+        'spotify_token_expires_at': datetime.now(timezone.utc) + timedelta(hours=1)
+    }
+
+
+def direct_update(user_id, n):
+    with app.app_context():
+        User.query.filter_by(id=user_id).update(token_fields(n))
+        db.session.commit()
+
+
+def queued_update(user_id, n):
+    app_module.write_queue.submit(user_id, token_fields(n))
+
+
+def run(mode, seconds, refreshers, user_ids, upstream):
+    update = direct_update if mode == 'direct' else queued_update
+    commits = [0]
+    updates = [0]
+    stop = threading.Event()
+    lock = threading.Lock()
+
+    def on_commit(conn):
+        commits[0] += 1
+
+    def refresher(offset):
+        n = offset
+        while not stop.is_set():
+            time.sleep(upstream)
+            update(user_ids[n % len(user_ids)], n)
+            n += refreshers
+            with lock:
+                updates[0] += 1
+
+    signup_latencies = []
+
+    def signups():
+        client = app.test_client()
+        n = 0
+        while not stop.is_set():
+            for limiter in ip_limiters.values():
+                limiter.clear()
+            started = time.perf_counter()
+            response = client.post('/api/signup', json={
+                'username': f'{mode}-{n}', 'email': f'{mode}-{n}@example.com', 'password': 'secret123'
+            })
+            signup_latencies.append(time.perf_counter() - started)
+            assert response.status_code == 201, response.get_json()
+            n += 1
+
+    event.listen(db.engine, 'commit', on_commit)
+    threads = [threading.Thread(target=refresher, args=(i,)) for i in range(refreshers)]
+    threads.append(threading.Thread(target=signups))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    app_module.write_queue.flush()
+    elapsed = time.perf_counter() - started
+    event.remove(db.engine, 'commit', on_commit)
+
+    signup_latencies.sort()
+    return {
+        'mode': mode,
+        'token_updates_per_sec': updates[0] / elapsed,
+        'commits_per_sec': commits[0] / elapsed,
+        'signups_per_sec': len(signup_latencies) / elapsed,
+        'signup_p50_ms': statistics.median(signup_latencies) * 1000,
+        'signup_p99_ms': signup_latencies[int(len(signup_latencies) * 0.99)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--refreshers', type=int, default=8)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--upstream-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        users = [User(username=f'seed{i}', email=f'seed{i}@example.com', password_hash='x',
+                      spotify_connected=True, spotify_refresh_token='refresh')
+                 for i in range(args.users)]
+        db.session.add_all(users)
+        db.session.commit()
+        user_ids = [user.id for user in users]
+
+        print(f"📊 {args.refreshers} refresher threads + 1 signup client, {args.seconds:g}s per mode ({_db_dir})")
+        for mode in ('direct', 'write-behind'):
+            result = run(mode, args.seconds, args.refreshers, user_ids, args.upstream_ms / 1000)
+            print(f"   {result['mode']:>12}: {result['token_updates_per_sec']:8.0f} token updates/s, "
+                  f"{result['commits_per_sec']:6.0f} commits/s, {result['signups_per_sec']:5.1f} signups/s, "
+                  f"signup p50 {result['signup_p50_ms']:.1f} ms, p99 {result['signup_p99_ms']:.1f} ms")
+    app_module.write_queue.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""Production runner: gunicorn app:app (run from backend/).
+
+A gevent worker serves each connection from a greenlet instead of an OS
+thread, so idle now-playing streams (which block in Subscription.wait)
+cost a socket and a little memory rather than a thread each. Gunicorn
+monkey-patches the worker before it imports the app, which makes the
+app's own threading waits cooperative too.
+
+One worker by default: the user cache, rate limiters, leaderboards and
+now-playing pollers live in process memory, and a single gevent worker
+already holds thousands of streams. Refresh token rotation is per process
+too: the ids of consumed refresh tokens are remembered in memory only, so
+with GUNICORN_WORKERS > 1 a refresh token can be replayed once against
+each other worker, and after any restart.
+
+SECRET_KEY must be set: it signs every token, and a per-process random key
+would make each worker reject the others' tokens.
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+worker_class = 'gevent'
+# Keep at 1 unless refresh replay across workers is acceptable (see above)
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 10000))
+# Streams stay open indefinitely; keep-alives are sent by the app itself
+timeout = 60
+graceful_timeout = 10
+
+
+def on_starting(server):
+    if not os.environ.get('SECRET_KEY'):
+        raise RuntimeError('SECRET_KEY must be set to run under gunicorn')
+
+
+def post_worker_init(worker):
+    from app import app, db
+    with app.app_context():
+        db.create_all()
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('SECRET_KEY', 'test-secret-key')
+os.environ.setdefault('LEADERBOARD_SNAPSHOT_PATH', '')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import app as flask_app, db, ip_limiters, login_failures, user_cache, write_queue  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.create_all()
+        user_cache.clear()
+        login_failures.clear()
+        for limiter in ip_limiters.values():
+            limiter.clear()
+        yield flask_app
+        write_queue.flush()
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def signup(client):
+    def _signup(username='listener', email='listener@example.com', password='secret123', **extra):
+        payload = {'username': username, 'email': email, 'password': password, **extra}
+        response = client.post('/api/signup', json=payload)
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()
+    return _signup
@@ -0,0 +1,149 @@
+import io
+import json
+
+import pytest
+
+from utils.tokens import TokenSigner, TokenError
+
+
+def auth_header(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def test_signed_token_round_trip():
+    signer = TokenSigner('secret', access_ttl=60)
+    claims = signer.verify(signer.issue(7, True))
+    assert claims['sub'] == 7
+    assert claims['sc'] is True
+
+
+def test_tampered_and_expired_tokens_are_rejected():
+    signer = TokenSigner('secret', access_ttl=60)
+    token = signer.issue(7, False, now=1000)
+
+    signature = token.split('.')[1]
+    other_payload = signer.issue(8, False, now=1000).split('.')[0]
+    with pytest.raises(TokenError):
+        signer.verify(f'{other_payload}.{signature}', now=1001)
+    with pytest.raises(TokenError):
+        TokenSigner('other-secret').verify(token, now=1001)
+    with pytest.raises(TokenError):
+        signer.verify(token, now=1060)
+
+
+def test_refresh_token_cannot_be_used_as_access_token():
+    signer = TokenSigner('secret')
+    pair = signer.issue_pair(1, False)
+    with pytest.raises(TokenError):
+        signer.verify(pair['refresh_token'])
+
+
+def test_consumed_refresh_ids_are_forgotten_once_expired():
+    signer = TokenSigner('secret', refresh_ttl=100)
+    old = [signer.issue(1, False, TokenSigner.REFRESH, now=0) for _ in range(3)]
+    for token in old:
+        signer.rotate(token, now=10)
+    with pytest.raises(TokenError):
+        signer.rotate(old[0], now=20)
+
+    signer.rotate(signer.issue(1, False, TokenSigner.REFRESH, now=90), now=150)
+    assert len(signer._consumed) == len(signer._expiries) == 1
+
+
+def test_login_issues_tokens(client, signup):
+    signup()
+    response = client.post('/api/login', json={'username': 'listener', 'password': 'secret123'})
+    data = response.get_json()
+    assert response.status_code == 200
+    assert data['token_type'] == 'Bearer'
+    assert data['access_token'] and data['refresh_token']
+
+
+def test_refresh_rotation_rejects_reuse(client, signup):
+    tokens = signup()
+    response = client.post('/api/token/refresh', json={'refresh_token': tokens['refresh_token']})
+    assert response.status_code == 200
+    rotated = response.get_json()
+    assert rotated['refresh_token'] != tokens['refresh_token']
+
+    replay = client.post('/api/token/refresh', json={'refresh_token': tokens['refresh_token']})
+    assert replay.status_code == 401
+
+
+def test_protected_routes_require_token(client, signup):
+    tokens = signup()
+    assert client.post('/api/spotify/auth-url', json={'user_id': 1}).status_code == 401
+
+    response = client.post('/api/spotify/playlists', headers=auth_header(tokens['access_token']))
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Spotify not connected'
+
+
+def test_profile_update_is_limited_to_token_owner(client, signup):
+    first = signup()
+    second = signup(username='other', email='other@example.com')
+    response = client.put(
+        f"/api/users/{first['user']['id']}/profile",
+        json={'genres': ['rock']},
+        headers=auth_header(second['access_token'])
+    )
+    assert response.status_code == 403
+
+
+def test_oversized_signup_is_rejected_before_parsing(client):
+    payload = {'username': 'listener', 'email': 'listener@example.com', 'password': 'secret123',
+               'profilePicture': 'x' * 10000}
+    response = client.post('/api/signup', json=payload)
+    assert response.status_code == 413
+
+
+def test_chunked_body_cannot_skip_the_route_cap(client):
+    body = json.dumps({'username': 'x' * 30000, 'password': 'secret123'}).encode()
+    # What a WSGI server hands over after de-chunking: a stream with no length
+    response = client.post('/api/login', input_stream=io.BytesIO(body),
+                           headers={'Content-Type': 'application/json', 'Transfer-Encoding': 'chunked'},
+                           environ_overrides={'wsgi.input_terminated': True})
+    assert response.status_code == 411
+
+
+def test_login_is_rate_limited_per_ip(client):
+    statuses = [client.post('/api/login', json={'username': f'user{i}', 'password': 'nope'}).status_code
+                for i in range(21)]
+    assert statuses[:20] == [401] * 20
+    assert statuses[20] == 429
+
+
+def test_failed_logins_are_throttled_per_account(client, signup, monkeypatch):
+    import app as app_module
+    signup()
+    checked = []
+    monkeypatch.setattr(app_module, 'check_password_hash', lambda *args: checked.append(args) or False)
+
+    for i in range(10):
+        client.post('/api/login', json={'username': 'listener', 'password': 'wrong'},
+                    environ_base={'REMOTE_ADDR': f'10.0.0.{i}'})
+    response = client.post('/api/login', json={'username': 'listener', 'password': 'secret123'},
+                           environ_base={'REMOTE_ADDR': '10.0.1.1'})
+
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+    assert len(checked) == 10
+
+
+def test_sliding_window_limiter_weights_previous_window():
+    from utils.rate_limit import SlidingWindowLimiter
+    now = [0.0]
+    limiter = SlidingWindowLimiter(limit=4, window=10, max_keys=2, clock=lambda: now[0])
+
+    assert all(limiter.hit('a')[0] for _ in range(4))
+    assert limiter.hit('a') == (False, 10)
+
+    # Halfway through the next window, half of the previous 4 hits still count
+    now[0] = 15
+    assert limiter.hit('a')[0]
+    assert limiter.hit('a')[0]
+    assert not limiter.hit('a')[0]
+
+    limiter.hit('b')
+    limiter.hit('c')
+    assert len(limiter) == 2
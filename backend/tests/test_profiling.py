@@ -0,0 +1,124 @@
+import cProfile
+import os
+import pstats
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import app as app_module
+from utils.profiling import RequestProfiler
+
+
+@pytest.fixture
+def profiler(tmp_path, monkeypatch):
+    profiler = RequestProfiler(str(tmp_path), enabled=True, debug_token='let-me-in', max_profiles=2)
+    monkeypatch.setattr(app_module, 'profiler', profiler)
+    return profiler
+
+
+def test_debug_header_profiles_request(client, profiler, tmp_path):
+    debug = {'X-Debug-Profile': 'let-me-in'}
+    assert client.get('/api/health', headers=debug).status_code == 200
+    assert client.get('/api/health').status_code == 200
+
+    listing = client.get('/api/admin/profiles', headers=debug).get_json()['profiles']
+    # The listing request is profiled too, but only written once it finishes
+    assert len(listing) == 1
+    health = listing[0]
+    assert health['route'] == 'health_check'
+    assert sorted(health['files']) == [f"{health['name']}.folded", f"{health['name']}.pstats"]
+
+    pstats.Stats(str(tmp_path / f"{health['name']}.pstats"))
+    download = client.get(f"/api/admin/profiles/{health['name']}.folded", headers=debug)
+    assert download.status_code == 200
+
+
+def test_admin_endpoints_require_token(client, profiler):
+    assert client.get('/api/admin/profiles').status_code == 404
+    assert client.get('/api/admin/profiles', headers={'X-Debug-Profile': 'wrong'}).status_code == 404
+    response = client.get('/api/admin/profiles/..%2Fapp.py', headers={'X-Debug-Profile': 'let-me-in'})
+    assert response.status_code == 404
+
+
+def test_non_ascii_debug_header_is_just_unauthorized(client, profiler, tmp_path):
+    # Werkzeug decodes headers as latin-1, so anyone can send these characters
+    headers = {'X-Debug-Profile': 'caf\u00e9'}
+    assert client.get('/api/health', headers=headers).status_code == 200
+    assert client.get('/api/admin/profiles', headers=headers).status_code == 404
+    assert list(tmp_path.iterdir()) == []
+
+    profiler.enabled = False
+    assert client.get('/api/admin/profiles', headers=headers).status_code == 404
+
+
+def test_only_newest_profiles_are_kept(client, profiler):
+    for _ in range(4):
+        client.get('/api/health', headers={'X-Debug-Profile': 'let-me-in'})
+    assert len(profiler.list_profiles()) == 2
+
+
+def test_disabled_profiler_writes_nothing(client, profiler, tmp_path):
+    profiler.enabled = False
+    client.get('/api/health', headers={'X-Debug-Profile': 'let-me-in'})
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_only_one_request_is_profiled_at_a_time(profiler):
+    first = profiler.start('let-me-in')
+    assert first is not None
+    assert profiler.start('let-me-in') is None
+
+    profiler.finish(first, 'health_check')
+    profiler.finish(profiler.start('let-me-in'), 'health_check')
+    assert len(profiler.list_profiles()) == 2
+
+
+def test_profiler_failure_never_fails_the_request(client, profiler, tmp_path, monkeypatch):
+    import utils.profiling
+
+    class BusyProfile:
+        def enable(self):
+            raise ValueError('Another profiling tool is already active')
+
+        def disable(self):
+            pass
+
+    monkeypatch.setattr(utils.profiling, 'cProfile', SimpleNamespace(Profile=BusyProfile))
+    assert client.get('/api/health', headers={'X-Debug-Profile': 'let-me-in'}).status_code == 200
+    assert list(tmp_path.iterdir()) == []
+
+    # The failed attempt released the profiler for the next request
+    monkeypatch.setattr(utils.profiling, 'cProfile', cProfile)
+    assert client.get('/api/health', headers={'X-Debug-Profile': 'let-me-in'}).status_code == 200
+    assert len(profiler.list_profiles()) == 1
+
+
+GEVENT_PROFILE_SCRIPT = """
+from gevent import monkey
+monkey.patch_all()
+import sys, time
+from utils.profiling import RequestProfiler
+
+def busy_request():
+    deadline = time.perf_counter() + 0.3
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+
+profiler = RequestProfiler(sys.argv[1], enabled=True, debug_token='let-me-in')
+handle = profiler.start('let-me-in')
+busy_request()
+name = profiler.finish(handle, 'busy')
+with open(f'{sys.argv[1]}/{name}.folded') as f:
+    print(f.read())
+"""
+
+
+def test_sampler_sees_cpu_bound_requests_under_gevent(tmp_path):
+    pytest.importorskip('gevent')
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', GEVENT_PROFILE_SCRIPT, str(tmp_path)], cwd=backend_dir,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert 'busy_request' in result.stdout
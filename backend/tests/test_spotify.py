@@ -0,0 +1,487 @@
+import json
+import math
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app as app_module
+from app import User, db, spotify_breakers, token_signer
+from utils.circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+from utils.spotify_catalog import SpotifyCatalog
+
+
+def artist(n, full=False):
+    data = {'id': f'ar{n}', 'name': f'Artist {n}', 'type': 'artist'}
+    if full:
+        data.update({'genres': [f'genre{n}'], 'popularity': n})
+    return data
+
+
+def track(n, artist_ids=(1,)):
+    return {
+        'id': f'tr{n}',
+        'name': f'Track {n}',
+        'album': {'id': f'al{n}', 'name': f'Album {n}', 'artists': [artist(a) for a in artist_ids]},
+        'artists': [artist(a) for a in artist_ids],
+    }
+
+
+def test_users_share_normalized_entities():
+    catalog = SpotifyCatalog()
+    catalog.store_list((1, 'top-tracks'), 'tracks', {'items': [track(1), track(2)], 'total': 2}, ttl=60)
+    catalog.store_list((2, 'top-tracks'), 'tracks', {'items': [track(2), track(3)], 'total': 2}, ttl=60)
+
+    assert catalog.size('tracks') == 3
+    assert catalog.size('artists') == 1
+
+    hydrated = catalog.hydrate_list((2, 'top-tracks'))
+    assert hydrated['total'] == 2
+    assert [t['id'] for t in hydrated['items']] == ['tr2', 'tr3']
+    assert hydrated['items'][0]['album']['name'] == 'Album 2'
+    assert hydrated['items'][0]['artists'][0]['name'] == 'Artist 1'
+
+
+def test_recently_played_keeps_play_metadata():
+    catalog = SpotifyCatalog()
+    plays = {'items': [{'track': track(1), 'played_at': '2024-01-01T00:00:00Z', 'context': None}]}
+    catalog.store_list((1, 'recently-played'), 'plays', plays, ttl=60)
+
+    item = catalog.hydrate_list((1, 'recently-played'))['items'][0]
+    assert item['played_at'] == '2024-01-01T00:00:00Z'
+    assert item['track']['id'] == 'tr1'
+
+
+def test_expired_lists_are_not_served():
+    catalog = SpotifyCatalog()
+    catalog.store_list((1, 'top-artists'), 'artists', {'items': [artist(1, full=True)]}, ttl=0)
+    assert catalog.hydrate_list((1, 'top-artists')) is None
+
+
+def test_evicted_tracks_are_bulk_fetched():
+    catalog = SpotifyCatalog(max_entities=100)
+    calls = []
+
+    def fetch_many(kind, ids):
+        calls.append((kind, list(ids)))
+        return [track(int(i[2:])) for i in ids]
+
+    catalog.store_list((1, 'top-tracks'), 'tracks', {'items': [track(n) for n in range(60)]}, ttl=60)
+    for n in range(100, 200):
+        catalog.add_track(track(n))
+    hydrated = catalog.hydrate_list((1, 'top-tracks'), fetch_many)
+
+    assert [t['id'] for t in hydrated['items']] == [f'tr{n}' for n in range(60)]
+    assert all(kind == 'tracks' and len(ids) <= 50 for kind, ids in calls)
+    assert len(calls) == 2
+
+
+def test_evicted_albums_and_artists_are_fetched_not_stubbed():
+    catalog = SpotifyCatalog(max_entities=3)
+    catalog.store_list((1, 'top-tracks'), 'tracks', {'items': [track(1)]}, ttl=60)
+    for n in range(2, 6):
+        catalog.add_artist(artist(n))
+        catalog.add_album({'id': f'al{n}', 'name': f'Album {n}', 'artists': []})
+    calls = []
+
+    # Without a way to fetch them, missing references make the list a miss
+    assert catalog.hydrate_list((1, 'top-tracks')) is None
+
+    def fetch_many(kind, ids):
+        calls.append((kind, list(ids)))
+        if kind == 'albums':
+            return [{'id': i, 'name': f'Album {i[2:]}', 'artists': [artist(1)], 'tracks': {'items': []}} for i in ids]
+        return [artist(int(i[2:])) for i in ids]
+
+    item = catalog.hydrate_list((1, 'top-tracks'), fetch_many)['items'][0]
+    assert calls == [('albums', ['al1'])]
+    assert item['album']['name'] == 'Album 1'
+    assert 'tracks' not in item['album']
+    assert item['artists'] == [artist(1)]
+
+
+def test_artist_genres_upgrade_simplified_artists():
+    catalog = SpotifyCatalog()
+    catalog.add_track(track(1, artist_ids=(1, 2)))
+    catalog.add_artist(artist(2, full=True))
+    calls = []
+
+    def fetch_many(kind, ids):
+        calls.append(list(ids))
+        return [artist(int(i[2:]), full=True) for i in ids]
+
+    genres = catalog.artist_genres(['ar1', 'ar2'], fetch_many)
+
+    assert calls == [['ar1']]
+    assert genres == {'ar1': ['genre1'], 'ar2': ['genre2']}
+    # A later simplified copy must not drop the genres we already have
+    catalog.add_artist(artist(1))
+    assert catalog.missing('artists', ['ar1'], require='genres') == []
+
+
+class FakeSpotify:
+    """Local stand-in for api.spotify.com whose health can be switched mid-test"""
+
+    def __init__(self):
+        self.mode = 'ok'
+        self.hits = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.hits += 1
+                if fake.mode == 'slow':
+                    time.sleep(1)
+                if fake.mode == 'down':
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                body = json.dumps({'items': [track(1), track(2)], 'total': 2}).encode()
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/v1'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fake_spotify(app, monkeypatch):
+    fake = FakeSpotify()
+    monkeypatch.setattr(app_module, 'SPOTIFY_API_URL', fake.url)
+    monkeypatch.setattr(app_module, 'spotify_catalog', SpotifyCatalog())
+    monkeypatch.setitem(app.config, 'SPOTIFY_TIMEOUT', 0.2)
+    monkeypatch.setattr(spotify_breakers, 'failure_threshold', 3)
+    monkeypatch.setattr(spotify_breakers, 'reset_timeout', 30)
+    spotify_breakers.clear()
+    yield fake
+    spotify_breakers.clear()
+    fake.close()
+
+
+@pytest.fixture
+def connected_token(app):
+    user = User(
+        username='listener',
+        email='listener@example.com',
+        password_hash='x',
+        spotify_connected=True,
+        spotify_access_token='spotify-token',
+        spotify_token_expires_at=datetime.now(timezone.utc) + timedelta(hours=1)
+    )
+    db.session.add(user)
+    db.session.commit()
+    return {'Authorization': f'Bearer {token_signer.issue(user.id, True)}'}
+
+
+def test_connecting_spotify_does_not_need_a_new_token(client, signup, fake_spotify):
+    tokens = signup()
+    headers = {'Authorization': f"Bearer {tokens['access_token']}"}
+    assert client.post('/api/spotify/playlists', headers=headers).status_code == 400
+
+    # What spotify_callback commits; the browser redirect never issues a new token
+    user = db.session.get(User, tokens['user']['id'])
+    user.spotify_connected = True
+    user.spotify_access_token = 'spotify-token'
+    user.spotify_token_expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    db.session.commit()
+    app_module.user_cache.invalidate(user.id)
+
+    assert client.post('/api/spotify/playlists', headers=headers).status_code == 200
+
+
+def test_breaker_opens_then_probes_half_open():
+    now = [0.0]
+    breaker = CircuitBreaker('api', failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+
+    now[0] = 10
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    now[0] = 20
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_lost_half_open_probe_does_not_wedge_the_breaker(client, fake_spotify, monkeypatch):
+    now = [0.0]
+    breaker = CircuitBreaker('api', failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    now[0] = 10
+    assert breaker.allow_request()  # a probe that never reports back
+
+    now[0] = 19
+    assert not breaker.allow_request()
+    now[0] = 20
+    assert breaker.state == OPEN
+    now[0] = 30
+    assert breaker.allow_request()
+
+    # spotify_request reports unexpected errors instead of leaking the probe
+    def explode(*args, **kwargs):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(spotify_breakers, 'failure_threshold', 1)
+    spotify_breakers.clear()
+    monkeypatch.setattr(app_module.requests, 'request', explode)
+    with pytest.raises(RuntimeError):
+        app_module.spotify_request('GET', f'{fake_spotify.url}/me')
+    assert spotify_breakers.states()[fake_spotify.url.split('/')[2]] == OPEN
+
+
+def test_outage_keeps_p99_bounded_and_serves_stale(client, fake_spotify, connected_token, monkeypatch):
+    monkeypatch.setitem(app_module.SPOTIFY_LIST_TTL, 'top-tracks', 0)
+    assert client.post('/api/spotify/top-tracks', headers=connected_token).status_code == 200
+
+    fake_spotify.mode = 'slow'
+    fake_spotify.hits = 0
+    latencies = []
+    for _ in range(300):
+        started = time.perf_counter()
+        response = client.post('/api/spotify/top-tracks', headers=connected_token)
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200
+        assert response.get_json()['stale'] is True
+
+    latencies.sort()
+    p99 = latencies[math.ceil(0.99 * len(latencies)) - 1]
+    # Only the requests that tripped the breaker waited for the timeout
+    assert fake_spotify.hits == 3
+    assert p99 < 0.1
+    assert latencies[-1] < 0.2 + 0.5
+    assert spotify_breakers.states()[fake_spotify.url.split('/')[2]] == OPEN
+
+
+def test_circuit_recovers_after_reset_timeout(client, fake_spotify, connected_token, monkeypatch):
+    monkeypatch.setattr(spotify_breakers, 'failure_threshold', 1)
+    monkeypatch.setattr(spotify_breakers, 'reset_timeout', 0.2)
+    spotify_breakers.clear()
+
+    fake_spotify.mode = 'down'
+    assert client.post('/api/spotify/top-artists', headers=connected_token).status_code == 500
+    assert client.post('/api/spotify/top-artists', headers=connected_token).status_code == 503
+    assert fake_spotify.hits == 1
+
+    time.sleep(0.25)
+    fake_spotify.mode = 'ok'
+    assert client.post('/api/spotify/top-artists', headers=connected_token).status_code == 200
+    assert set(spotify_breakers.states().values()) == {CLOSED}
+
+
+def test_open_accounts_circuit_serves_stale_data_not_auth_errors(client, fake_spotify, connected_token,
+                                                                 monkeypatch):
+    monkeypatch.setitem(app_module.SPOTIFY_LIST_TTL, 'top-tracks', 0)
+    monkeypatch.setattr(app_module, 'SPOTIFY_CLIENT_ID', 'client-id', raising=False)
+    monkeypatch.setattr(app_module, 'SPOTIFY_CLIENT_SECRET', 'client-secret', raising=False)
+    assert client.post('/api/spotify/top-tracks', headers=connected_token).status_code == 200
+
+    User.query.update({'spotify_token_expires_at': datetime.now(timezone.utc) - timedelta(minutes=1),
+                       'spotify_refresh_token': 'refresh'})
+    db.session.commit()
+    app_module.user_cache.clear()
+    accounts = spotify_breakers.get(app_module.SPOTIFY_ACCOUNTS_URL.split('/')[2])
+    for _ in range(spotify_breakers.failure_threshold):
+        accounts.record_failure()
+
+    response = client.post('/api/spotify/top-tracks', headers=connected_token)
+    assert response.status_code == 200
+    assert response.get_json()['stale'] is True
+    assert client.post('/api/spotify/top-artists', headers=connected_token).status_code == 503
+    assert client.post('/api/spotify/user-data', headers=connected_token).status_code == 503
+
+
+def test_now_playing_hub_fans_out_one_poll_to_all_subscribers():
+    from utils.now_playing import NowPlayingHub
+    polls = []
+    states = iter([{'track': 'a', 'progress_ms': 1}, {'track': 'a', 'progress_ms': 2}, {'track': 'b'}])
+
+    def fetch(user_id):
+        polls.append(user_id)
+        return next(states)
+
+    now = [0.0]
+    hub = NowPlayingHub(fetch, min_interval=2, max_interval=8, backoff=2, clock=lambda: now[0])
+    first, second = hub.subscribe(1), hub.subscribe(1)
+
+    hub.poll_once(1)
+    assert first.wait(0) == second.wait(0) == {'track': 'a', 'progress_ms': 1}
+
+    # Progress alone is not a change: nothing is published and polling backs off
+    hub.poll_once(1)
+    assert first.wait(0) is None
+    assert hub._pollers[1].interval == 4
+
+    # A late subscriber starts from the last known state
+    late = hub.subscribe(1)
+    assert late.wait(0) == {'track': 'a', 'progress_ms': 2}
+
+    hub.poll_once(1)
+    assert first.wait(0) == {'track': 'b'}
+    assert hub._pollers[1].interval == 2
+    assert polls == [1, 1, 1]
+
+
+def test_now_playing_poller_stops_without_subscribers():
+    from utils.now_playing import NowPlayingHub
+    hub = NowPlayingHub(lambda user_id: {'track': 'a'})
+    subscriptions = [hub.subscribe(7) for _ in range(1000)]
+    assert hub.active_users() == [7]
+    assert hub.subscriber_count(7) == 1000
+
+    for subscription in subscriptions:
+        hub.unsubscribe(subscription)
+    assert hub.active_users() == []
+    hub.poll_once(7)
+    assert hub._due() == []
+
+
+def test_disconnect_ends_now_playing_streams(client, connected_token, monkeypatch):
+    from utils.now_playing import NowPlayingHub
+    hub = NowPlayingHub(app_module.fetch_now_playing, min_interval=60)
+    monkeypatch.setattr(app_module, 'now_playing_hub', hub)
+    monkeypatch.setattr(hub, 'start', lambda: None)  # polled by hand below
+
+    stream = client.get('/api/spotify/now-playing/stream', headers=connected_token, buffered=False)
+    chunks = iter(stream.response)
+    assert next(chunks) == b'retry: 5000\n\n'
+
+    assert client.post('/api/spotify/disconnect', headers=connected_token).status_code == 200
+    hub.poll_once(1)
+
+    assert next(chunks) == b'event: end\ndata: {"reason": "spotify_disconnected"}\n\n'
+    assert list(chunks) == []
+    assert hub.active_users() == []
+    stream.close()
+
+
+def test_now_playing_stream_shares_poller(client, connected_token, monkeypatch):
+    from utils.now_playing import NowPlayingHub
+    polls = []
+
+    def fetch(user_id):
+        polls.append(user_id)
+        return {'is_playing': True, 'track': {'id': 'tr1'}}
+
+    hub = NowPlayingHub(fetch, min_interval=5)
+    monkeypatch.setattr(app_module, 'now_playing_hub', hub)
+    threads_before = threading.active_count()
+    try:
+        streams = [client.get('/api/spotify/now-playing/stream', headers=connected_token, buffered=False)
+                   for _ in range(50)]
+        for stream in streams:
+            assert stream.mimetype == 'text/event-stream'
+            chunks = iter(stream.response)
+            assert next(chunks) == b'retry: 5000\n\n'
+            event = next(chunks).decode()
+            assert event.startswith('event: now_playing\n')
+            assert json.loads(event.split('data: ', 1)[1]) == {'is_playing': True, 'track': {'id': 'tr1'}}
+
+        assert polls == [1]
+        assert threading.active_count() - threads_before <= hub.workers + 1
+    finally:
+        for stream in streams:
+            stream.close()
+        hub.stop()
+    assert hub.active_users() == []
+
+
+def process_tree_threads(pid):
+    """OS threads in a process and all of its descendants (Linux only)"""
+    total = 0
+    for tid in os.listdir(f'/proc/{pid}/task'):
+        total += 1
+        with open(f'/proc/{pid}/task/{tid}/children') as f:
+            total += sum(process_tree_threads(int(child)) for child in f.read().split())
+    return total
+
+
+def open_stream(port, token):
+    sock = socket.create_connection(('127.0.0.1', port), timeout=10)
+    sock.sendall((f'GET /api/spotify/now-playing/stream HTTP/1.1\r\nHost: localhost\r\n'
+                  f'Authorization: Bearer {token}\r\n\r\n').encode())
+    received = b''
+    while b'retry: 5000' not in received:
+        chunk = sock.recv(4096)
+        assert chunk, received
+        received += chunk
+    assert received.startswith(b'HTTP/1.1 200')
+    return sock
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='counts threads through /proc')
+def test_gevent_runner_holds_streams_without_a_thread_each(tmp_path):
+    pytest.importorskip('gevent')
+    pytest.importorskip('gunicorn')
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    db_path = tmp_path / 'app.db'
+    env = {
+        **os.environ,
+        'DATABASE_URL': f'sqlite:///{db_path}',
+        'GUNICORN_BIND': f'127.0.0.1:{port}',
+        # Polls fail fast and back off; the streams still open and idle
+        'SPOTIFY_API_URL': 'http://127.0.0.1:9/v1',
+    }
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app'], cwd=backend_dir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    streams = []
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                # Answered once the worker has booted and created the tables
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/api/health', timeout=1).close()
+                break
+            except OSError:
+                assert time.monotonic() < deadline and server.poll() is None, 'gunicorn did not start'
+                time.sleep(0.1)
+        with sqlite3.connect(db_path) as conn:
+            conn.execute(
+                "INSERT INTO user (id, username, email, password_hash, spotify_connected, "
+                "spotify_access_token, spotify_token_expires_at) "
+                "VALUES (1, 'listener', 'listener@example.com', 'x', 1, 'spotify-token', '2999-01-01 00:00:00')"
+            )
+        token = token_signer.issue(1, True)
+
+        streams.append(open_stream(port, token))
+        baseline = process_tree_threads(server.pid)
+        streams.extend(open_stream(port, token) for _ in range(300))
+        assert process_tree_threads(server.pid) - baseline < 10
+    finally:
+        for stream in streams:
+            stream.close()
+        server.terminate()
+        server.wait(timeout=30)
@@ -0,0 +1,328 @@
+import random
+import threading
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from utils.user_cache import IdentityCache
+
+
+def auth_header(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    return statements, lambda: event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def snapshot(user_id, version, username=None):
+    return SimpleNamespace(id=user_id, username=username or f'user{user_id}',
+                           email=f'user{user_id}@example.com', version=version)
+
+
+def test_repeat_login_is_served_from_cache(app, client, signup):
+    signup()
+    client.post('/api/login', json={'username': 'listener', 'password': 'secret123'})
+
+    statements, stop = count_queries()
+    try:
+        response = client.post('/api/login', json={'username': 'listener@example.com', 'password': 'secret123'})
+    finally:
+        stop()
+    assert response.status_code == 200
+    assert not [s for s in statements if 'FROM user' in s]
+
+
+def test_profile_update_invalidates_cached_user(client, signup):
+    tokens = signup(genres=['rock'])
+    client.post('/api/login', json={'username': 'listener', 'password': 'secret123'})
+
+    response = client.put(
+        f"/api/users/{tokens['user']['id']}/profile",
+        json={'genres': ['jazz', 'blues']},
+        headers=auth_header(tokens['access_token'])
+    )
+    assert response.status_code == 200
+
+    login = client.post('/api/login', json={'username': 'listener', 'password': 'secret123'})
+    assert login.get_json()['user']['genres'] == ['jazz', 'blues']
+
+
+def test_load_racing_an_invalidation_is_not_cached():
+    cache = IdentityCache()
+    generation = cache.generation
+    stale = snapshot(1, version=1)
+
+    cache.invalidate(1)
+    cache.put(stale, generation)
+
+    assert cache.get(1) is None
+    assert cache.get_by('username', 'user1') is None
+
+
+def test_cache_is_bounded_and_drops_secondary_keys():
+    cache = IdentityCache(maxsize=2)
+    for user_id in (1, 2, 3):
+        cache.put(snapshot(user_id, version=1), cache.generation)
+
+    assert len(cache) == 2
+    assert cache.get(1) is None
+    assert cache.get_by('email', 'user1@example.com') is None
+    assert cache.get_by('email', 'user3@example.com').id == 3
+
+
+def test_cached_entries_expire_so_other_workers_catch_up():
+    now = [0.0]
+    cache = IdentityCache(ttl=30, clock=lambda: now[0])
+    cache.put(snapshot(1, version=1), cache.generation)
+
+    now[0] = 29
+    assert cache.get_by('username', 'user1').version == 1
+    now[0] = 30
+    assert cache.get(1) is None
+    assert cache.get_by('username', 'user1') is None
+    assert len(cache) == 0
+
+
+def test_concurrent_updates_leave_cache_coherent():
+    cache = IdentityCache(maxsize=8)
+    store = {user_id: 0 for user_id in range(16)}
+    store_lock = threading.Lock()
+    stop = threading.Event()
+
+    def reader():
+        rng = random.Random()
+        while not stop.is_set():
+            user_id = rng.randrange(16)
+            if cache.get(user_id) is None:
+                generation = cache.generation
+                with store_lock:
+                    version = store[user_id]
+                cache.put(snapshot(user_id, version), generation)
+
+    def writer():
+        rng = random.Random()
+        for _ in range(2000):
+            user_id = rng.randrange(16)
+            with store_lock:
+                store[user_id] += 1
+            cache.invalidate(user_id)
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    writers = [threading.Thread(target=writer) for _ in range(4)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    for user_id, version in store.items():
+        cached = cache.get(user_id)
+        assert cached is None or cached.version == version
+
+
+def test_profile_genres_feed_leaderboard_as_deltas(client, signup, monkeypatch):
+    import app as app_module
+    from utils.leaderboards import Leaderboards
+    monkeypatch.setattr(app_module, 'leaderboards', Leaderboards())
+
+    first = signup(genres=['rock', 'jazz'])
+    signup(username='other', email='other@example.com', genres=['rock'])
+    client.put(
+        f"/api/users/{first['user']['id']}/profile",
+        json={'genres': ['blues']},
+        headers=auth_header(first['access_token'])
+    )
+
+    entries = client.get('/api/leaderboards/genres?window=all_time').get_json()['entries']
+    assert sorted((e['key'], e['score']) for e in entries) == [('blues', 1.0), ('rock', 1.0)]
+    assert client.get('/api/leaderboards/moods').status_code == 404
+
+
+def test_leaderboard_decays_older_signals():
+    from utils.leaderboards import Leaderboards
+    now = [0.0]
+    boards = Leaderboards(clock=lambda: now[0])
+    week = 7 * 24 * 3600
+
+    boards.update(1, 'top_artists', {'artists': ['old']}, labels={'artists': {'old': 'Old Artist'}})
+    now[0] = week
+    boards.update(2, 'top_artists', {'artists': ['new']})
+
+    weekly = boards.top('artists', 'week')
+    assert [e['key'] for e in weekly] == ['new', 'old']
+    assert weekly[1] == {'key': 'old', 'name': 'Old Artist', 'score': 0.5}
+    assert {e['score'] for e in boards.top('artists', 'all_time')} == {1.0}
+
+    # Retracting a contribution removes exactly what it added, however old it is
+    boards.remove(1, ('top_artists',))
+    assert [e['key'] for e in boards.top('artists', 'week')] == ['new']
+
+
+def test_leaderboard_snapshot_round_trip(tmp_path):
+    from utils.leaderboards import Leaderboards
+    now = [1000.0]
+    boards = Leaderboards(clock=lambda: now[0])
+    boards.update(1, 'top_tracks', {'tracks': ['t1', 't2'], 'artists': ['a1']})
+    boards.update(2, 'top_tracks', {'tracks': ['t1']})
+    boards.save(str(tmp_path / 'leaderboards.json'))
+
+    restored = Leaderboards(clock=lambda: now[0])
+    assert restored.load(str(tmp_path / 'leaderboards.json'))
+    assert restored.top('tracks', 'month') == boards.top('tracks', 'month')
+
+    restored.update(1, 'top_tracks', {'tracks': ['t2']})
+    assert sorted((e['key'], e['score']) for e in restored.top('tracks', 'all_time')) == [('t1', 1.0), ('t2', 1.0)]
+    assert restored.top('artists', 'all_time') == []
+
+
+def test_leaderboard_retractions_leave_no_ghosts_after_long_uptime():
+    from utils.leaderboards import Leaderboards
+    genres = ['rock', 'pop', 'jazz', 'metal', 'folk', 'blues']
+    for seed in range(20):
+        rng = random.Random(seed)
+        now = [0.0]
+        boards = Leaderboards(clock=lambda: now[0])
+        # ~6 months in, stored week-window values are around 2**26
+        now[0] = 180 * 24 * 3600
+        for user_id in range(30):
+            now[0] += rng.uniform(0, 3600)
+            picked = rng.sample(genres, 3)
+            boards.update(user_id, 'profile', {'genres': picked}, labels={'genres': {g: g.title() for g in picked}})
+        for user_id in rng.sample(range(30), 30):
+            boards.remove(user_id, ('profile',))
+
+        for window in ('week', 'month', 'all_time'):
+            assert boards.top('genres', window) == []
+            assert boards.boards['genres'][window].scores == {}
+        assert boards.labels['genres'] == {}
+
+
+def test_leaderboard_snapshot_has_a_single_writer(tmp_path):
+    from utils.leaderboards import Leaderboards
+    path = str(tmp_path / 'leaderboards.json')
+    owner, other = Leaderboards(), Leaderboards()
+
+    # Nothing changed, so nothing is written (and no ownership is claimed)
+    assert not other.save_if_dirty(path)
+    assert not (tmp_path / 'leaderboards.json').exists()
+
+    owner.update(1, 'profile', {'genres': ['rock']})
+    assert owner.save_if_dirty(path)
+    assert not owner.save_if_dirty(path)
+
+    other.update(2, 'profile', {'genres': ['jazz']})
+    assert not other.save_if_dirty(path)
+    restored = Leaderboards()
+    restored.load(path)
+    assert [e['key'] for e in restored.top('genres', 'all_time')] == ['rock']
+
+
+def test_leaderboard_rebases_before_overflow():
+    from utils.leaderboards import Leaderboards
+    now = [0.0]
+    boards = Leaderboards(clock=lambda: now[0])
+    boards.update(1, 'profile', {'genres': ['rock']})
+
+    now[0] = 40 * 365 * 24 * 3600
+    boards.update(2, 'profile', {'genres': ['jazz']})
+    boards.remove(1, ('profile',))
+
+    assert [(e['key'], e['score']) for e in boards.top('genres', 'week')] == [('jazz', 1.0)]
+
+
+def test_write_behind_coalesces_updates_into_one_batch():
+    from utils.write_behind import WriteBehindQueue
+    batches = []
+    queue = WriteBehindQueue(batches.append)
+
+    queue.submit(1, {'token': 'a', 'name': 'Old'})
+    queue.submit(1, {'token': 'b'})
+    queue.submit(2, {'token': 'c'})
+    assert queue.pending(1) == {'token': 'b', 'name': 'Old'}
+
+    queue.flush()
+    assert batches == [{1: {'token': 'b', 'name': 'Old'}, 2: {'token': 'c'}}]
+    assert queue.pending(1) == {}
+    assert (queue.batches_committed, queue.updates_committed) == (1, 2)
+
+
+def test_write_behind_group_writers_share_commits():
+    from utils.write_behind import WriteBehindQueue
+    batches = []
+    queue = WriteBehindQueue(batches.append, interval=0.01, durability='group')
+    queue.start()
+    try:
+        writers = [threading.Thread(target=queue.submit, args=(i, {'token': str(i)})) for i in range(20)]
+        for thread in writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+    finally:
+        queue.stop()
+
+    # Every writer returned only after its update was committed
+    assert sorted(key for batch in batches for key in batch) == list(range(20))
+    assert len(batches) < 20
+
+
+def test_write_behind_failed_batch_is_retried_and_stop_flushes():
+    from utils.write_behind import WriteBehindQueue, WriteFailed
+    batches = []
+    fail = [True]
+
+    def apply_batch(updates):
+        if fail[0]:
+            fail[0] = False
+            raise RuntimeError('database is locked')
+        batches.append(updates)
+
+    queue = WriteBehindQueue(apply_batch, durability='group')
+    with pytest.raises(WriteFailed):
+        queue.submit(1, {'token': 'a', 'name': 'Old'})
+    queue.submit(1, {'token': 'b'}, durability='async')
+    assert queue.pending(1) == {'token': 'b', 'name': 'Old'}
+
+    queue.stop()
+    assert batches == [{1: {'token': 'b', 'name': 'Old'}}]
+
+
+def test_refreshed_spotify_token_is_read_before_it_is_written(app, signup, monkeypatch):
+    import app as app_module
+    from app import User, user_cache
+    from utils.write_behind import WriteBehindQueue
+    queue = WriteBehindQueue(app_module.persist_user_updates, on_commit=app_module.invalidate_users)
+    monkeypatch.setattr(app_module, 'write_queue', queue)
+    monkeypatch.setattr(app_module, 'SPOTIFY_CLIENT_ID', 'client-id', raising=False)
+    monkeypatch.setattr(app_module, 'SPOTIFY_CLIENT_SECRET', 'client-secret', raising=False)
+    monkeypatch.setattr(app_module, 'spotify_request', lambda *args, **kwargs: SimpleNamespace(
+        status_code=200, json=lambda: {'access_token': 'fresh-token', 'expires_in': 3600}))
+
+    user_id = signup()['user']['id']
+    User.query.filter_by(id=user_id).update({'spotify_connected': True, 'spotify_refresh_token': 'refresh'})
+    db.session.commit()
+    user_cache.invalidate(user_id)
+
+    def stored_token():
+        return db.session.execute(db.select(User.spotify_access_token).filter_by(id=user_id)).scalar()
+
+    refreshed = app_module.refresh_spotify_token(app_module.get_cached_user(user_id))
+    assert refreshed.spotify_access_token == 'fresh-token'
+    assert refreshed.is_spotify_token_valid()
+    assert stored_token() is None
+    assert app_module.get_cached_user(user_id).spotify_access_token == 'fresh-token'
+
+    queue.flush()
+    assert stored_token() == 'fresh-token'
+    assert app_module.get_cached_user(user_id).spotify_access_token == 'fresh-token'
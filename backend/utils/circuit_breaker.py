@@ -0,0 +1,124 @@
+import threading
+import time
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Thread-safe circuit breaker for one upstream dependency.
+
+    closed     calls go through; ``failure_threshold`` consecutive failures
+               open the circuit
+    open       calls are refused (``allow_request`` returns False) until
+               ``reset_timeout`` seconds have passed
+    half_open  up to ``half_open_max_calls`` probe calls are let through;
+               a success closes the circuit, a failure opens it again.
+               A probe that reports nothing within ``reset_timeout``
+               seconds (it raised something unexpected or was killed)
+               counts as a failure, so a lost probe can't wedge the
+               circuit half-open
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, half_open_max_calls=1, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_started_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        now = self._clock()
+        if (self._state == HALF_OPEN and self._probes >= self.half_open_max_calls
+                and now - self._probe_started_at >= self.reset_timeout):
+            self._state = OPEN
+            self._opened_at = now
+        if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def retry_after(self):
+        """Seconds until an open circuit lets a probe through"""
+        with self._lock:
+            if self._current_state() != OPEN:
+                return 0
+            return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+
+    def allow_request(self):
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                self._probe_started_at = self._clock()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probes = 0
+
+    def record_failure(self):
+        with self._lock:
+            state = self._current_state()
+            self._failures += 1
+            if state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = self._clock()
+                self._failures = 0
+
+    def reset(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probes = 0
+
+
+class CircuitBreakerRegistry:
+    """One shared CircuitBreaker per upstream name, created on first use"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, half_open_max_calls=1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    name,
+                    failure_threshold=self.failure_threshold,
+                    reset_timeout=self.reset_timeout,
+                    half_open_max_calls=self.half_open_max_calls
+                )
+                self._breakers[name] = breaker
+            return breaker
+
+    def states(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.state for breaker in breakers}
+
+    def clear(self):
+        with self._lock:
+            self._breakers.clear()
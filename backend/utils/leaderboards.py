@@ -0,0 +1,271 @@
+import heapq
+import json
+import math
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory file locks, assume a single process
+    fcntl = None
+
+
+DIMENSIONS = ('genres', 'artists', 'tracks')
+
+# Window name -> half-life in seconds (None keeps every signal forever)
+WINDOWS = {
+    'all_time': None,
+    'month': 30 * 24 * 3600,
+    'week': 7 * 24 * 3600,
+}
+
+# Rebase a board before its forward-decay multiplier gets near float overflow
+_MAX_EXPONENT = 300
+
+
+class DecayedBoard:
+    """Exponentially decayed scores for one dimension and window.
+
+    Uses forward decay: a signal at time ``t`` is stored as
+    ``w * exp(rate * (t - t0))`` and the current score is the stored sum times
+    ``exp(-rate * (now - t0))``. Old scores never need touching as time
+    passes, and a contribution can later be retracted exactly by subtracting
+    the value it was stored with. The top entries are cached until the next
+    change; when the board grows past ``capacity`` the weakest keys are
+    dropped so memory stays bounded.
+    """
+
+    def __init__(self, half_life=None, capacity=10000, t0=0.0):
+        self.rate = math.log(2) / half_life if half_life else 0.0
+        self.capacity = capacity
+        self.t0 = t0
+        self.scores = {}
+        self._top = None
+
+    def scale(self, now):
+        """Multiplier for a signal arriving at ``now``"""
+        return math.exp(self.rate * (now - self.t0)) if self.rate else 1.0
+
+    def decay(self, now):
+        """Multiplier turning stored values into current scores"""
+        return math.exp(-self.rate * (now - self.t0)) if self.rate else 1.0
+
+    def needs_rebase(self, now):
+        return self.rate and self.rate * (now - self.t0) > _MAX_EXPONENT
+
+    def rebase(self, now):
+        """Move t0 to now; returns the factor stored values must be multiplied by"""
+        factor = self.decay(now)
+        self.t0 = now
+        for key in self.scores:
+            self.scores[key] *= factor
+        self._top = None
+        return factor
+
+    def add(self, key, value, now):
+        score = self.scores.get(key, 0.0) + value
+        # Stored values grow with scale(now), and so does the rounding left
+        # over after retracting them; compare the score as it reads now
+        if score <= self.scale(now) * 1e-9:
+            self.scores.pop(key, None)
+        else:
+            self.scores[key] = score
+        self._top = None
+        if len(self.scores) > self.capacity * 1.1:
+            self.scores = dict(heapq.nlargest(self.capacity, self.scores.items(), key=lambda item: item[1]))
+
+    def top(self, limit, now):
+        if self._top is None:
+            self._top = heapq.nlargest(100, self.scores.items(), key=lambda item: item[1])
+        decay = self.decay(now)
+        return [(key, score * decay) for key, score in self._top[:limit]]
+
+
+class Leaderboards:
+    """Global top genres, artists and tracks, maintained from per-user deltas.
+
+    ``update(user_id, source, items)`` replaces what one source (signup or
+    profile genres, Spotify top tracks, Spotify top artists) says about one
+    user: the previous contribution is retracted and the new one added, so
+    each update costs O(items for that user) and nothing is recomputed.
+
+    Several processes may load the same snapshot path, but only one writes
+    it: the first to change something takes an exclusive lock on
+    ``<path>.lock`` and keeps it until it exits. Processes that never change
+    anything (such as the debug reloader's parent) never write.
+    """
+
+    def __init__(self, windows=WINDOWS, capacity=10000, clock=time.time):
+        self.windows = windows
+        self.capacity = capacity
+        self._clock = clock
+        now = clock()
+        self.boards = {
+            dimension: {window: DecayedBoard(half_life, capacity, now) for window, half_life in windows.items()}
+            for dimension in DIMENSIONS
+        }
+        self.labels = {dimension: {} for dimension in DIMENSIONS}
+        # (user_id, source) -> {dimension: {key: {window: stored value}}}
+        self.contributions = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+        self._snapshot_thread = None
+        self._owner_lock = None
+        self._owner_warned = False
+
+    def update(self, user_id, source, items, labels=None):
+        """Replace one source's contribution for a user.
+
+        ``items`` maps dimension to an iterable of keys; ``labels`` maps
+        dimension to {key: display name}.
+        """
+        with self._lock:
+            now = self._clock()
+            self._retract((user_id, source), now)
+            contribution = {}
+            for dimension, keys in items.items():
+                entries = {}
+                for key in dict.fromkeys(k for k in keys if k):
+                    entries[key] = {}
+                    for window, board in self.boards[dimension].items():
+                        if board.needs_rebase(now):
+                            self._rebase(dimension, window, now)
+                        value = board.scale(now)
+                        board.add(key, value, now)
+                        entries[key][window] = value
+                if entries:
+                    contribution[dimension] = entries
+                for key, label in ((labels or {}).get(dimension) or {}).items():
+                    if key in entries:
+                        self.labels[dimension][key] = label
+            if contribution:
+                self.contributions[(user_id, source)] = contribution
+            self.dirty = True
+
+    def remove(self, user_id, sources):
+        with self._lock:
+            now = self._clock()
+            for source in sources:
+                self._retract((user_id, source), now)
+            self.dirty = True
+
+    def _retract(self, contribution_key, now):
+        contribution = self.contributions.pop(contribution_key, None)
+        for dimension, entries in (contribution or {}).items():
+            for key, values in entries.items():
+                for window, value in values.items():
+                    self.boards[dimension][window].add(key, -value, now)
+                if all(key not in board.scores for board in self.boards[dimension].values()):
+                    self.labels[dimension].pop(key, None)
+
+    def _rebase(self, dimension, window, now):
+        factor = self.boards[dimension][window].rebase(now)
+        for contribution in self.contributions.values():
+            for values in contribution.get(dimension, {}).values():
+                if window in values:
+                    values[window] *= factor
+
+    def top(self, dimension, window='week', limit=10):
+        with self._lock:
+            now = self._clock()
+            labels = self.labels[dimension]
+            return [
+                {'key': key, 'name': labels.get(key, key), 'score': round(score, 4)}
+                for key, score in self.boards[dimension][window].top(limit, now)
+            ]
+
+    # -- snapshots ----------------------------------------------------------
+
+    def snapshot(self):
+        """Serialize everything to a JSON string (under the lock, so it is consistent)"""
+        with self._lock:
+            self.dirty = False
+            return json.dumps({
+                'boards': {
+                    dimension: {window: {'t0': board.t0, 'scores': board.scores} for window, board in boards.items()}
+                    for dimension, boards in self.boards.items()
+                },
+                'labels': self.labels,
+                'contributions': [[user_id, source, contribution]
+                                  for (user_id, source), contribution in self.contributions.items()]
+            }, separators=(',', ':'))
+
+    def restore(self, data):
+        with self._lock:
+            for dimension, boards in data.get('boards', {}).items():
+                for window, saved in boards.items():
+                    board = self.boards.get(dimension, {}).get(window)
+                    if board is not None:
+                        board.t0 = saved['t0']
+                        board.scores = dict(saved['scores'])
+                        board._top = None
+            for dimension, labels in data.get('labels', {}).items():
+                if dimension in self.labels:
+                    self.labels[dimension] = dict(labels)
+            self.contributions = {(user_id, source): contribution
+                                  for user_id, source, contribution in data.get('contributions', [])}
+
+    def save(self, path):
+        """Atomically write a snapshot to ``path``"""
+        data = self.snapshot()
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Restore from ``path`` if a snapshot exists; returns whether one was loaded"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print(f"❌ Could not load leaderboard snapshot {path}: {e}")
+            return False
+        self.restore(data)
+        return True
+
+    def save_if_dirty(self, path):
+        """Save to ``path`` if something changed and this process owns it; returns whether it saved"""
+        if not self.dirty or not self._acquire_owner(path):
+            return False
+        try:
+            self.save(path)
+        except OSError as e:
+            print(f"❌ Could not save leaderboard snapshot {path}: {e}")
+            return False
+        return True
+
+    def _acquire_owner(self, path):
+        if self._owner_lock is not None:
+            return True
+        if fcntl is None:
+            self._owner_lock = True
+            return True
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        lock_file = open(f'{path}.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            if not self._owner_warned:
+                self._owner_warned = True
+                print(f"⚠️ Another process owns leaderboard snapshot {path}; not saving from this one")
+            return False
+        self._owner_lock = lock_file
+        return True
+
+    def start_snapshots(self, path, interval):
+        """Save to ``path`` every ``interval`` seconds whenever something changed"""
+        def run():
+            while True:
+                time.sleep(interval)
+                self.save_if_dirty(path)
+
+        if self._snapshot_thread is None:
+            self._snapshot_thread = threading.Thread(target=run, name='leaderboard-snapshots', daemon=True)
+            self._snapshot_thread.start()
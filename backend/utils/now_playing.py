@@ -0,0 +1,219 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StopPolling(Exception):
+    """Raised by ``fetch`` when a user can no longer be polled (e.g. Spotify was disconnected)"""
+
+
+class Subscription:
+    """One stream's view of a user's now-playing state.
+
+    Only the latest event is kept, so a slow client skips straight to the
+    current state instead of queueing stale ones, and an idle connection
+    costs one small object and an Event.
+    """
+
+    __slots__ = ('user_id', 'latest', 'closed', '_ready')
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.latest = None
+        self.closed = None
+        self._ready = threading.Event()
+
+    def publish(self, event):
+        self.latest = event
+        self._ready.set()
+
+    def close(self, reason):
+        """End the stream; ``closed`` holds the reason and ``wait`` returns at once from now on"""
+        self.closed = reason
+        self._ready.set()
+
+    def wait(self, timeout):
+        """Return the newest event, or None if nothing changed within ``timeout`` seconds"""
+        if not self._ready.wait(timeout):
+            return None
+        if self.closed is None:
+            self._ready.clear()
+        return self.latest
+
+
+class _UserPoller:
+    __slots__ = ('user_id', 'subscribers', 'state', 'interval', 'next_run', 'polling')
+
+    def __init__(self, user_id, interval):
+        self.user_id = user_id
+        self.subscribers = set()
+        self.state = None
+        self.interval = interval
+        self.next_run = 0.0
+        self.polling = False
+
+
+class NowPlayingHub:
+    """Fan out one upstream poller per active user to all of their streams.
+
+    ``fetch(user_id)`` returns the user's current state as a dict (or raises).
+    A single scheduler thread keeps a heap of due polls and hands them to a
+    small worker pool, so the number of threads does not grow with the number
+    of users or connections. A poll that sees a change publishes it to every
+    subscriber and polls again after ``min_interval``; unchanged polls back
+    off towards ``max_interval``, and while a track is playing the next poll
+    is pulled forward to just after it should end. A user's poller is dropped
+    as soon as their last subscriber leaves, or as soon as ``fetch`` raises
+    StopPolling, which closes every one of their subscriptions.
+
+    Keys listed in ``volatile_keys`` (such as playback progress) are sent to
+    subscribers but ignored when deciding whether the state changed.
+    """
+
+    volatile_keys = ('progress_ms', 'remaining_ms')
+
+    def __init__(self, fetch, min_interval=3.0, max_interval=30.0, backoff=1.5, workers=4,
+                 clock=time.monotonic):
+        self.fetch = fetch
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.workers = workers
+        self._clock = clock
+        self._pollers = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = None
+        self._scheduler = None
+        self._running = False
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='now-playing')
+            self._scheduler = threading.Thread(target=self._run, name='now-playing-scheduler', daemon=True)
+            self._scheduler.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._scheduler is not None:
+            self._scheduler.join()
+            self._executor.shutdown(wait=True)
+            self._scheduler = None
+
+    def active_users(self):
+        with self._cond:
+            return list(self._pollers)
+
+    def subscriber_count(self, user_id=None):
+        with self._cond:
+            if user_id is not None:
+                poller = self._pollers.get(user_id)
+                return len(poller.subscribers) if poller else 0
+            return sum(len(p.subscribers) for p in self._pollers.values())
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self._cond:
+            poller = self._pollers.get(user_id)
+            if poller is None:
+                poller = _UserPoller(user_id, self.min_interval)
+                self._pollers[user_id] = poller
+                self._schedule(poller, self._clock())
+            elif poller.state is not None:
+                subscription.publish(poller.state)
+            poller.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._cond:
+            poller = self._pollers.get(subscription.user_id)
+            if poller is None:
+                return
+            poller.subscribers.discard(subscription)
+            if not poller.subscribers:
+                del self._pollers[subscription.user_id]
+
+    def poll_once(self, user_id):
+        """Poll one user now, publish on change and schedule the next poll"""
+        try:
+            state = self.fetch(user_id)
+            failed = False
+        except StopPolling as e:
+            with self._cond:
+                poller = self._pollers.pop(user_id, None)
+                for subscription in (poller.subscribers if poller else ()):
+                    subscription.close(str(e) or 'stopped')
+            return
+        except Exception as e:
+            print(f"❌ Now playing poll failed for user {user_id}: {e}")
+            state, failed = None, True
+
+        with self._cond:
+            poller = self._pollers.get(user_id)
+            if poller is None:
+                return
+            poller.polling = False
+
+            if failed:
+                poller.interval = self.max_interval
+            elif self._changed(poller.state, state):
+                poller.state = state
+                poller.interval = self.min_interval
+                for subscription in poller.subscribers:
+                    subscription.publish(state)
+            else:
+                poller.state = state
+                poller.interval = min(poller.interval * self.backoff, self.max_interval)
+
+            delay = poller.interval
+            remaining = (state or {}).get('remaining_ms')
+            if remaining is not None and (state or {}).get('is_playing'):
+                delay = max(self.min_interval, min(delay, remaining / 1000 + 1))
+            self._schedule(poller, self._clock() + delay)
+
+    def _changed(self, old, new):
+        if old is None or new is None:
+            return old is not new
+        def stable(state):
+            return {k: v for k, v in state.items() if k not in self.volatile_keys}
+        return stable(old) != stable(new)
+
+    def _schedule(self, poller, when):
+        # Caller holds self._cond
+        poller.next_run = when
+        heapq.heappush(self._heap, (when, next(self._seq), poller.user_id))
+        self._cond.notify()
+
+    def _due(self):
+        # Caller holds self._cond; pops heap entries that are due and still current
+        now = self._clock()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, _, user_id = heapq.heappop(self._heap)
+            poller = self._pollers.get(user_id)
+            if poller is None or poller.polling or poller.next_run != when:
+                continue
+            poller.polling = True
+            due.append(user_id)
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                due = self._due()
+                if not due:
+                    timeout = self._heap[0][0] - self._clock() if self._heap else None
+                    self._cond.wait(timeout)
+                    continue
+            for user_id in due:
+                self._executor.submit(self.poll_once, user_id)
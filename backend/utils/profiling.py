@@ -0,0 +1,200 @@
+import _thread
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+try:
+    from gevent.monkey import get_original
+except ImportError:
+    def get_original(module, name):
+        return getattr(__import__(module), name)
+
+# Real OS-thread primitives, even when gevent has monkey-patched threading:
+# the sampler must run on a native thread (a greenlet never gets scheduled
+# while a CPU-bound request holds the loop) and look up the native thread id,
+# which is what sys._current_frames() is keyed by.
+_get_ident = get_original('_thread', 'get_ident')
+_start_new_thread = get_original('_thread', 'start_new_thread')
+_allocate_lock = get_original('_thread', 'allocate_lock')
+_sleep = get_original('time', 'sleep')
+
+
+class StackSampler:
+    """Sample one OS thread's Python stack from a native background thread.
+
+    Produces collapsed stacks (``outer;inner;leaf count`` per line), the
+    input format of flamegraph.pl and speedscope. Under gevent every
+    greenlet shares the worker's OS thread, so each sample shows whichever
+    greenlet was running at the time; a request that yields to I/O can pick
+    up a few samples from other greenlets.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._running = False
+        self._done = _allocate_lock()
+
+    def start(self):
+        self._running = True
+        self._done.acquire()
+        _start_new_thread(self._run, ())
+
+    def stop(self):
+        if self._running:
+            self._running = False
+            self._done.acquire()
+            self._done.release()
+
+    def _run(self):
+        try:
+            while self._running:
+                _sleep(self.interval)
+                self._sample()
+        finally:
+            self._done.release()
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        if frames:
+            self.stacks[';'.join(reversed(frames))] += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class RequestProfiler:
+    """Opt-in per-request profiler.
+
+    A request is profiled when profiling is enabled and either a random draw
+    falls under ``sample_rate`` or it carries ``debug_token`` in the debug
+    header. Each profiled request writes ``<route>-<timestamp>.pstats``
+    (cProfile) and ``.folded`` (sampled collapsed stacks) into
+    ``output_dir``; only the newest ``max_profiles`` requests are kept.
+
+    When disabled, ``start`` returns after a single attribute check.
+
+    Only one request is profiled at a time: on Python 3.12+ cProfile hooks
+    the process-wide ``sys.monitoring``, so a second profiler would fail to
+    enable. A request that arrives while another is being profiled is simply
+    not profiled, and a profiling error never fails the request itself.
+    """
+
+    def __init__(self, output_dir, enabled=False, sample_rate=0.0, debug_token=None,
+                 max_profiles=200, sample_interval=0.005):
+        self.output_dir = output_dir
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.debug_token = debug_token
+        self.max_profiles = max_profiles
+        self.sample_interval = sample_interval
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+
+    def is_authorized(self, token):
+        # Compare bytes: compare_digest raises TypeError on non-ASCII str, and
+        # header values can hold any latin-1 character
+        if not self.debug_token or not token:
+            return False
+        return hmac.compare_digest(token.encode('utf-8'), self.debug_token.encode('utf-8'))
+
+    def should_profile(self, debug_header):
+        if self.is_authorized(debug_header):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, debug_header=None):
+        """Begin profiling the current request, or return None if it is not selected"""
+        if not self.enabled:
+            return None
+        try:
+            if not self.should_profile(debug_header):
+                return None
+        except Exception as e:
+            print(f"❌ Could not decide whether to profile: {e}")
+            return None
+        if not self._active.acquire(blocking=False):
+            return None
+        sampler = StackSampler(_get_ident(), self.sample_interval)
+        profile = cProfile.Profile()
+        try:
+            sampler.start()
+            profile.enable()
+        except Exception as e:
+            print(f"❌ Could not start profiling: {e}")
+            self._stop(profile, sampler)
+            return None
+        return profile, sampler
+
+    def finish(self, handle, route):
+        """Stop profiling and write the pstats and collapsed-stack files; returns the base name, or None on error"""
+        profile, sampler = handle
+        self._stop(profile, sampler)
+
+        try:
+            route = re.sub(r'[^A-Za-z0-9_]+', '_', route or 'unknown')
+            name = f'{route}-{time.strftime("%Y%m%dT%H%M%S")}-{time.time_ns() % 1000000:06d}'
+            os.makedirs(self.output_dir, exist_ok=True)
+            profile.dump_stats(os.path.join(self.output_dir, f'{name}.pstats'))
+            with open(os.path.join(self.output_dir, f'{name}.folded'), 'w', encoding='utf-8') as f:
+                f.write(sampler.collapsed())
+            self._prune()
+        except Exception as e:
+            print(f"❌ Could not write profile: {e}")
+            return None
+        return name
+
+    def _stop(self, profile, sampler):
+        # Disable both collectors (either may not have started), then let the next request in
+        try:
+            profile.disable()
+            sampler.stop()
+        finally:
+            self._active.release()
+
+    def list_profiles(self):
+        """Newest first: one entry per profiled request with its route and files"""
+        if not os.path.isdir(self.output_dir):
+            return []
+        profiles = {}
+        for filename in os.listdir(self.output_dir):
+            base, ext = os.path.splitext(filename)
+            if ext not in ('.pstats', '.folded'):
+                continue
+            path = os.path.join(self.output_dir, filename)
+            entry = profiles.setdefault(base, {
+                'name': base,
+                'route': base.rsplit('-', 2)[0],
+                'created_at': os.path.getmtime(path),
+                'files': []
+            })
+            entry['files'].append(filename)
+        return sorted(profiles.values(), key=lambda p: p['created_at'], reverse=True)
+
+    def path_for(self, filename):
+        """Absolute path of a profile file, or None if it is not one of ours"""
+        if os.path.basename(filename) != filename or os.path.splitext(filename)[1] not in ('.pstats', '.folded'):
+            return None
+        path = os.path.join(self.output_dir, filename)
+        return path if os.path.isfile(path) else None
+
+    def _prune(self):
+        with self._lock:
+            for profile in self.list_profiles()[self.max_profiles:]:
+                for filename in profile['files']:
+                    try:
+                        os.remove(os.path.join(self.output_dir, filename))
+                    except OSError:
+                        pass
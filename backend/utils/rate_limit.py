@@ -0,0 +1,85 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class SlidingWindowLimiter:
+    """Sliding-window rate limiter with O(1) memory per key.
+
+    Uses the sliding-window counter approximation: each key keeps only the
+    counts of the current and previous fixed windows, and the previous count
+    is weighted by how much of it still overlaps the sliding window. Keys
+    live in an LRU of at most ``max_keys`` entries, so memory stays bounded
+    no matter how many IPs or accounts show up; a key that gets evicted just
+    starts from zero again.
+    """
+
+    def __init__(self, limit, window, max_keys=100000, clock=time.monotonic):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._clock = clock
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._counters)
+
+    def _counter(self, key, now):
+        # Returns [window_index, previous_count, current_count], rolled forward to now
+        index = int(now // self.window)
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = [index, 0, 0]
+            self._counters[key] = counter
+            while len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+        else:
+            self._counters.move_to_end(key)
+            if index == counter[0] + 1:
+                counter[:] = [index, counter[2], 0]
+            elif index != counter[0]:
+                counter[:] = [index, 0, 0]
+        return counter
+
+    def _estimate(self, counter, now):
+        overlap = 1 - (now % self.window) / self.window
+        return counter[1] * overlap + counter[2]
+
+    def _retry_after(self, now):
+        # Worst case: wait for the current window to become the previous one
+        return max(1, math.ceil(self.window - now % self.window))
+
+    def check(self, key):
+        """Return (allowed, retry_after) without counting an attempt"""
+        with self._lock:
+            now = self._clock()
+            counter = self._counter(key, now)
+            if self._estimate(counter, now) >= self.limit:
+                return False, self._retry_after(now)
+            return True, 0
+
+    def add(self, key):
+        """Count an attempt without checking the limit"""
+        with self._lock:
+            now = self._clock()
+            self._counter(key, now)[2] += 1
+
+    def hit(self, key):
+        """Count an attempt if it is within the limit; return (allowed, retry_after)"""
+        with self._lock:
+            now = self._clock()
+            counter = self._counter(key, now)
+            if self._estimate(counter, now) >= self.limit:
+                return False, self._retry_after(now)
+            counter[2] += 1
+            return True, 0
+
+    def reset(self, key):
+        with self._lock:
+            self._counters.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
@@ -0,0 +1,230 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Spotify's multi-ID endpoints cap how many ids one call may ask for
+BATCH_SIZES = {'tracks': 50, 'artists': 50, 'albums': 20}
+
+
+class SpotifyCatalog:
+    """Normalized store of Spotify tracks, artists, albums and playlists.
+
+    Entities are kept once, keyed by Spotify ID, and shared by every user.
+    Nested objects are replaced by ids when stored (a track keeps its album
+    id and artist ids), and richer copies are merged over poorer ones, so a
+    simplified artist seen inside a track is upgraded in place when the full
+    artist (with genres) arrives.
+
+    Per-user responses are stored as lists of ids plus the non-entity fields
+    of the original response (paging info, ``played_at`` and so on) and are
+    rebuilt with ``hydrate_list``. Entities that were evicted in the meantime,
+    including the albums and artists a stored track refers to, are fetched in
+    bulk through the caller's ``fetch_many(kind, ids)``; if they cannot be,
+    the list is treated as a miss.
+    """
+
+    def __init__(self, max_entities=50000, max_lists=10000):
+        self.max_entities = max_entities
+        self.max_lists = max_lists
+        self._stores = {kind: OrderedDict() for kind in ('tracks', 'artists', 'albums', 'playlists')}
+        self._lists = OrderedDict()
+        self._lock = threading.Lock()
+
+    def size(self, kind):
+        return len(self._stores[kind])
+
+    # -- ingest -------------------------------------------------------------
+
+    def add_artist(self, artist):
+        return self._merge('artists', artist)
+
+    def add_album(self, album):
+        album = dict(album)
+        # Full albums from /v1/albums list their tracks; those are stored as tracks, not here
+        album.pop('tracks', None)
+        album['artists'] = [self.add_artist(a) for a in album.get('artists') or [] if a.get('id')]
+        return self._merge('albums', album)
+
+    def add_track(self, track):
+        track = dict(track)
+        if track.get('album') and track['album'].get('id'):
+            track['album'] = self.add_album(track['album'])
+        track['artists'] = [self.add_artist(a) for a in track.get('artists') or [] if a.get('id')]
+        return self._merge('tracks', track)
+
+    def add_playlist(self, playlist):
+        return self._merge('playlists', playlist)
+
+    def _merge(self, kind, entity):
+        entity_id = entity.get('id')
+        if not entity_id:
+            return None
+        store = self._stores[kind]
+        with self._lock:
+            existing = store.get(entity_id)
+            if existing is None:
+                store[entity_id] = dict(entity)
+            else:
+                existing.update(entity)
+                store.move_to_end(entity_id)
+            while len(store) > self.max_entities:
+                store.popitem(last=False)
+        return entity_id
+
+    # -- per-user lists -----------------------------------------------------
+
+    def store_list(self, key, kind, response, ttl):
+        """Normalize a paging response and remember it under ``key`` for ``ttl`` seconds.
+
+        ``kind`` is 'tracks', 'artists', 'playlists' or 'plays' (recently
+        played items, which wrap a track with ``played_at``).
+        """
+        meta = {k: v for k, v in response.items() if k != 'items'}
+        refs = []
+        for item in response.get('items') or []:
+            if kind == 'plays':
+                track_id = self.add_track(item['track']) if item.get('track') else None
+                if track_id:
+                    refs.append({**item, 'track': track_id})
+            else:
+                entity_id = getattr(self, self._ADDERS[kind])(item)
+                if entity_id:
+                    refs.append(entity_id)
+
+        with self._lock:
+            self._lists[key] = (time.monotonic() + ttl, kind, refs, meta)
+            self._lists.move_to_end(key)
+            while len(self._lists) > self.max_lists:
+                self._lists.popitem(last=False)
+
+    def hydrate_list(self, key, fetch_many=None, allow_stale=False):
+        """Rebuild a stored response, or return None if it is missing or expired.
+
+        Expired responses stay around (bounded by ``max_lists``) so they can
+        still be served with ``allow_stale`` while Spotify is unavailable.
+        """
+        with self._lock:
+            entry = self._lists.get(key)
+            if entry is None:
+                return None
+            expires_at, kind, refs, meta = entry
+            if not allow_stale and time.monotonic() >= expires_at:
+                return None
+
+        if kind == 'plays':
+            track_ids = [ref['track'] for ref in refs]
+        else:
+            track_ids = refs if kind == 'tracks' else []
+
+        if track_ids:
+            self.ensure_tracks(track_ids, fetch_many)
+        if kind in ('artists', 'playlists'):
+            self.ensure(kind, refs, fetch_many)
+
+        items = []
+        for ref in refs:
+            if kind == 'plays':
+                track = self.get_track(ref['track'])
+                if track is None:
+                    return None
+                items.append({**ref, 'track': track})
+            else:
+                entity = self.get_track(ref) if kind == 'tracks' else self._get(kind, ref)
+                if entity is None:
+                    return None
+                items.append(entity)
+        return {**meta, 'items': items}
+
+    def invalidate_user(self, user_id):
+        """Drop every stored response for a user (keys start with the user id)"""
+        with self._lock:
+            for key in [k for k in self._lists if k[0] == user_id]:
+                del self._lists[key]
+
+    # -- lookups ------------------------------------------------------------
+
+    def _get(self, kind, entity_id):
+        with self._lock:
+            entity = self._stores[kind].get(entity_id)
+            return dict(entity) if entity is not None else None
+
+    def get_track(self, track_id):
+        """Return a track with its album and artists expanded.
+
+        Returns None if the track, or an album or artist it refers to, is no
+        longer stored, rather than a track with bare ``{'id': ...}`` stubs.
+        """
+        track = self._get('tracks', track_id)
+        if track is None:
+            return None
+        if isinstance(track.get('album'), str):
+            album = self._get('albums', track['album'])
+            if album is None:
+                return None
+            album['artists'] = self._get_all('artists', album.get('artists', []))
+            if album['artists'] is None:
+                return None
+            track['album'] = album
+        track['artists'] = self._get_all('artists', track.get('artists', []))
+        if track['artists'] is None:
+            return None
+        return track
+
+    def _get_all(self, kind, ids):
+        entities = [self._get(kind, i) for i in ids]
+        return None if None in entities else entities
+
+    def _references(self, track_ids):
+        # Album ids and artist ids (of the tracks and their albums) referenced by stored tracks
+        with self._lock:
+            tracks = [self._stores['tracks'].get(i) for i in track_ids]
+            album_ids = [t['album'] for t in tracks if t is not None and isinstance(t.get('album'), str)]
+            artist_ids = [a for t in tracks if t is not None for a in t.get('artists', [])]
+            for album_id in album_ids:
+                album = self._stores['albums'].get(album_id)
+                artist_ids.extend(album.get('artists', []) if album is not None else [])
+        return album_ids, artist_ids
+
+    def missing(self, kind, ids, require=None):
+        """Ids that are not stored, or whose stored copy lacks the ``require`` field"""
+        store = self._stores[kind]
+        with self._lock:
+            return [i for i in dict.fromkeys(ids)
+                    if i not in store or (require and require not in store[i])]
+
+    def ensure(self, kind, ids, fetch_many, require=None):
+        """Bulk-fetch whatever ``missing`` reports, one multi-ID call per batch"""
+        if fetch_many is None or kind not in BATCH_SIZES:
+            return
+        missing = self.missing(kind, ids, require)
+        batch_size = BATCH_SIZES[kind]
+        for start in range(0, len(missing), batch_size):
+            for entity in fetch_many(kind, missing[start:start + batch_size]) or []:
+                if entity:
+                    getattr(self, self._ADDERS[kind])(entity)
+
+    def ensure_tracks(self, track_ids, fetch_many):
+        """Bulk-fetch missing tracks, then the albums and artists they refer to"""
+        self.ensure('tracks', track_ids, fetch_many)
+        album_ids, _ = self._references(track_ids)
+        self.ensure('albums', album_ids, fetch_many)
+        _, artist_ids = self._references(track_ids)
+        self.ensure('artists', artist_ids, fetch_many)
+
+    def artist_genres(self, artist_ids, fetch_many=None):
+        """Map artist id to genres, fetching full artists where only simplified ones are stored"""
+        self.ensure('artists', artist_ids, fetch_many, require='genres')
+        genres = {}
+        for artist_id in artist_ids:
+            artist = self._get('artists', artist_id)
+            if artist is not None and 'genres' in artist:
+                genres[artist_id] = artist['genres']
+        return genres
+
+    _ADDERS = {
+        'tracks': 'add_track',
+        'artists': 'add_artist',
+        'albums': 'add_album',
+        'playlists': 'add_playlist',
+    }
@@ -0,0 +1,136 @@
+import base64
+import hashlib
+import heapq
+import hmac
+import json
+import secrets
+import threading
+import time
+
+
+class TokenError(Exception):
+    """Raised when a token is malformed, forged, expired or already used"""
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    padding = '=' * (-len(text) % 4)
+    return base64.urlsafe_b64decode(text + padding)
+
+
+class TokenSigner:
+    """Issue and verify compact HMAC-SHA256 signed tokens.
+
+    A token is ``base64url(claims).base64url(signature)``. Claims are kept
+    short so the token stays small:
+
+        sub  user id
+        sc   spotify_connected at issue time
+        typ  'a' for access tokens, 'r' for refresh tokens
+        iat  issued at (unix seconds)
+        exp  expires at (unix seconds)
+        jti  unique id (refresh tokens only, used for rotation)
+
+    Verifying an access token needs only the secret, so authenticating a
+    request never touches the database or the filesystem. Refresh tokens are
+    single use: ``rotate`` remembers consumed ids until they expire, so a
+    replayed refresh token is rejected. Those ids live in this process only;
+    they are lost on restart and not shared between workers.
+    """
+
+    ACCESS = 'a'
+    REFRESH = 'r'
+
+    def __init__(self, secret, access_ttl=900, refresh_ttl=14 * 24 * 3600):
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        self._secret = secret
+        self.access_ttl = access_ttl
+        self.refresh_ttl = refresh_ttl
+        self._consumed = set()
+        self._expiries = []  # heap of (exp, jti) for pruning consumed ids
+        self._lock = threading.Lock()
+
+    def _sign(self, payload):
+        return hmac.new(self._secret, payload, hashlib.sha256).digest()
+
+    def _encode(self, claims):
+        payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+        signature = _b64encode(self._sign(payload.encode('ascii')))
+        return f'{payload}.{signature}'
+
+    def issue(self, user_id, spotify_connected, token_type=ACCESS, now=None):
+        """Create a single signed token for a user"""
+        now = int(now if now is not None else time.time())
+        ttl = self.access_ttl if token_type == self.ACCESS else self.refresh_ttl
+        claims = {
+            'sub': user_id,
+            'sc': bool(spotify_connected),
+            'typ': token_type,
+            'iat': now,
+            'exp': now + ttl,
+        }
+        if token_type == self.REFRESH:
+            claims['jti'] = secrets.token_urlsafe(12)
+        return self._encode(claims)
+
+    def issue_pair(self, user_id, spotify_connected, now=None):
+        """Create an access/refresh token pair for a freshly authenticated user"""
+        return {
+            'access_token': self.issue(user_id, spotify_connected, self.ACCESS, now),
+            'refresh_token': self.issue(user_id, spotify_connected, self.REFRESH, now),
+            'token_type': 'Bearer',
+            'expires_in': self.access_ttl,
+        }
+
+    def verify(self, token, token_type=ACCESS, now=None):
+        """Check signature, type and expiry and return the token claims"""
+        if not token or not isinstance(token, str) or token.count('.') != 1:
+            raise TokenError('Malformed token')
+
+        payload, signature = token.split('.', 1)
+        try:
+            expected = self._sign(payload.encode('ascii'))
+            if not hmac.compare_digest(expected, _b64decode(signature)):
+                raise TokenError('Invalid token signature')
+            claims = json.loads(_b64decode(payload))
+        except (ValueError, UnicodeError):
+            raise TokenError('Malformed token')
+
+        if not isinstance(claims, dict) or claims.get('typ') != token_type:
+            raise TokenError('Wrong token type')
+
+        now = now if now is not None else time.time()
+        if now >= claims.get('exp', 0):
+            raise TokenError('Token expired')
+
+        return claims
+
+    def rotate(self, refresh_token, now=None):
+        """Consume a refresh token and return its claims.
+
+        The caller issues the replacement pair; each refresh token can be
+        rotated exactly once.
+        """
+        claims = self.verify(refresh_token, self.REFRESH, now)
+        now = now if now is not None else time.time()
+
+        with self._lock:
+            if claims['jti'] in self._consumed:
+                raise TokenError('Refresh token already used')
+            self._prune(now)
+            self._consumed.add(claims['jti'])
+            heapq.heappush(self._expiries, (claims['exp'], claims['jti']))
+
+        return claims
+
+    def _prune(self, now):
+        # Once a refresh token has expired, verify() rejects it anyway,
+        # so its id no longer needs to be remembered. Popping from the
+        # expiry heap only touches ids that actually expired.
+        while self._expiries and self._expiries[0][0] <= now:
+            _, jti = heapq.heappop(self._expiries)
+            self._consumed.discard(jti)
@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class IdentityCache:
+    """Bounded, thread-safe LRU cache of user snapshots.
+
+    Entries are keyed by ``id`` with secondary indexes on the fields named in
+    ``keys`` (username and email by default), so every lookup the routes do
+    can be answered from memory.
+
+    Coherence: writers call ``invalidate`` after committing. Readers take
+    ``generation`` *before* loading a row from the database and pass it to
+    ``put``; if any invalidation happened in between, the loaded row may be
+    stale and is not cached.
+
+    ``invalidate`` only reaches this process. Other workers sharing the
+    database never hear about a write, so every entry also expires ``ttl``
+    seconds after it was loaded; that bounds how long another worker can
+    serve a stale row.
+    """
+
+    def __init__(self, maxsize=10000, keys=('username', 'email'), ttl=30, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.keys = keys
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._indexes = {key: {} for key in keys}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, user_id):
+        with self._lock:
+            return self._lookup(user_id)
+
+    def get_by(self, key, value):
+        with self._lock:
+            return self._lookup(self._indexes[key].get(value))
+
+    def _lookup(self, user_id):
+        # Caller holds self._lock
+        entry = self._entries.get(user_id) if user_id is not None else None
+        if entry is not None and self._clock() >= entry[0]:
+            self._remove(user_id)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, snapshot, generation):
+        """Cache a snapshot loaded at ``generation``; returns the snapshot either way"""
+        with self._lock:
+            if generation != self._generation:
+                return snapshot
+            self._remove(snapshot.id)
+            self._entries[snapshot.id] = (self._clock() + self.ttl, snapshot)
+            for key in self.keys:
+                self._indexes[key][getattr(snapshot, key)] = snapshot.id
+            while len(self._entries) > self.maxsize:
+                oldest_id = next(iter(self._entries))
+                self._remove(oldest_id)
+            return snapshot
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._remove(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            for index in self._indexes.values():
+                index.clear()
+
+    def _remove(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        snapshot = entry[1]
+        for key in self.keys:
+            index = self._indexes[key]
+            value = getattr(snapshot, key)
+            if index.get(value) == user_id:
+                del index[value]
@@ -0,0 +1,141 @@
+import threading
+import time
+
+
+class WriteFailed(Exception):
+    """Raised to a waiting writer when the batch holding its update failed to commit"""
+
+
+class _Batch:
+    __slots__ = ('updates', 'done', 'error')
+
+    def __init__(self):
+        self.updates = {}
+        self.done = threading.Event()
+        self.error = None
+
+
+class WriteBehindQueue:
+    """Coalesce non-critical row updates and commit them in batches.
+
+    ``submit(key, fields)`` merges ``fields`` into the pending update for
+    ``key``. A background thread wakes up ``interval`` seconds after the
+    first pending update and hands everything gathered so far to
+    ``apply_batch({key: fields})``, which must write it in one transaction.
+    A key updated several times before a flush is written once, with the
+    newest values.
+
+    Durability is chosen per call (or by the ``durability`` default):
+
+        'async'  submit returns at once; an update can be lost if the
+                 process dies before the next flush
+        'group'  submit blocks until the batch holding the update has
+                 committed, sharing that commit with every other writer
+
+    ``pending(key)`` returns fields submitted but not yet committed, so
+    readers can overlay them on what they load and see their own writes.
+    A batch that fails to commit is put back in the queue and retried after
+    ``retry_delay`` seconds; ``stop`` flushes whatever is left.
+    """
+
+    def __init__(self, apply_batch, interval=0.005, durability='async', on_commit=None, retry_delay=1.0):
+        if durability not in ('async', 'group'):
+            raise ValueError(f'Unknown durability mode: {durability}')
+        self.apply_batch = apply_batch
+        self.interval = interval
+        self.durability = durability
+        self.on_commit = on_commit
+        self.retry_delay = retry_delay
+        self.batches_committed = 0
+        self.updates_committed = 0
+        self._open = _Batch()
+        self._in_flight = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background thread after flushing every pending update"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def submit(self, key, fields, durability=None):
+        durability = durability or self.durability
+        with self._cond:
+            batch = self._open
+            batch.updates.setdefault(key, {}).update(fields)
+            self._cond.notify_all()
+
+        if durability == 'group':
+            if not self._running:
+                self.flush()
+            batch.done.wait()
+            if batch.error is not None:
+                raise WriteFailed(str(batch.error))
+
+    def pending(self, key):
+        """Fields for ``key`` that are queued or being committed, newest last"""
+        with self._cond:
+            fields = {}
+            if self._in_flight is not None:
+                fields.update(self._in_flight.updates.get(key, {}))
+            fields.update(self._open.updates.get(key, {}))
+            return fields
+
+    def flush(self):
+        """Commit everything queued so far on the calling thread; returns False if the commit failed"""
+        with self._flush_lock:
+            with self._cond:
+                batch = self._open
+                if not batch.updates:
+                    return True
+                self._open = _Batch()
+                self._in_flight = batch
+
+            try:
+                self.apply_batch(batch.updates)
+            except Exception as e:
+                print(f"❌ Write-behind batch of {len(batch.updates)} update(s) failed: {e}")
+                batch.error = e
+                with self._cond:
+                    # Keep the updates for the next batch; newer submissions win
+                    for key, fields in batch.updates.items():
+                        self._open.updates[key] = {**fields, **self._open.updates.get(key, {})}
+                    self._in_flight = None
+                batch.done.set()
+                return False
+
+            if self.on_commit is not None:
+                self.on_commit(list(batch.updates))
+            with self._cond:
+                self._in_flight = None
+                self.batches_committed += 1
+                self.updates_committed += len(batch.updates)
+            batch.done.set()
+            return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._open.updates:
+                    self._cond.wait()
+                if not self._running:
+                    return
+            # Let concurrent writers pile into the same batch
+            time.sleep(self.interval)
+            if not self.flush():
+                time.sleep(self.retry_delay)
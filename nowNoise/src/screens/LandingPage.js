@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import {
   View,
   Text,
@@ -32,6 +32,72 @@ const LandingPage = ({ user, onLogout, onUserUpdate }) => {
 
   const API_BASE_URL = 'http://localhost:5000/api';
 
+  // Latest token pair, so concurrent calls retry with whatever was rotated last
+  const tokensRef = useRef({ access: user.access_token, refresh: user.refresh_token });
+  const refreshPromiseRef = useRef(null);
+
+  useEffect(() => {
+    tokensRef.current = { access: user.access_token, refresh: user.refresh_token };
+  }, [user.access_token, user.refresh_token]);
+
+  // Refresh tokens are single use, so concurrent 401s share one rotation
+  const refreshTokens = () => {
+    if (!refreshPromiseRef.current) {
+      refreshPromiseRef.current = (async () => {
+        try {
+          const response = await fetch(`${API_BASE_URL}/token/refresh`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ refresh_token: tokensRef.current.refresh }),
+          });
+          if (!response.ok) {
+            return false;
+          }
+          const data = await response.json();
+          tokensRef.current = { access: data.access_token, refresh: data.refresh_token };
+          if (onUserUpdate) {
+            onUserUpdate({
+              ...user,
+              access_token: data.access_token,
+              refresh_token: data.refresh_token,
+            });
+          }
+          return true;
+        } catch (error) {
+          console.error('Error refreshing session:', error);
+          return false;
+        } finally {
+          refreshPromiseRef.current = null;
+        }
+      })();
+    }
+    return refreshPromiseRef.current;
+  };
+
+  // fetch with the access token; on 401 rotate the token pair once and retry
+  const authFetch = async (path, options = {}) => {
+    const send = () => fetch(`${API_BASE_URL}${path}`, {
+      ...options,
+      headers: {
+        ...options.headers,
+        'Authorization': `Bearer ${tokensRef.current.access}`,
+      },
+    });
+
+    const response = await send();
+    if (response.status !== 401) {
+      return response;
+    }
+    if (!(await refreshTokens())) {
+      Alert.alert('Session expired', 'Please log in again.');
+      if (onLogout) {
+        onLogout();
+      }
+      return response;
+    }
+    return send();
+  };
+
   // Handle deep linking for Spotify auth
   useEffect(() => {
     const handleDeepLink = (url) => {
@@ -55,14 +121,11 @@ const LandingPage = ({ user, onLogout, onUserUpdate }) => {
     try {
       setIsConnectingSpotify(true);
       
-      const response = await fetch(`${API_BASE_URL}/spotify/auth-url`, {
+      const response = await authFetch('/spotify/auth-url', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({
-          user_id: user.id
-        }),
       });
 
       const data = await response.json();
@@ -97,14 +160,11 @@ const LandingPage = ({ user, onLogout, onUserUpdate }) => {
           style: 'destructive',
           onPress: async () => {
             try {
-              const response = await fetch(`${API_BASE_URL}/spotify/disconnect`, {
+              const response = await authFetch('/spotify/disconnect', {
                 method: 'POST',
                 headers: {
                   'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({
-                  user_id: user.id
-                }),
               });
 
               const data = await response.json();
@@ -119,6 +179,8 @@ const LandingPage = ({ user, onLogout, onUserUpdate }) => {
                 if (onUserUpdate) {
                   const updatedUser = {
                     ...user,
+                    access_token: data.access_token,
+                    refresh_token: data.refresh_token,
                     spotify_connected: false,
                     spotify_display_name: null,
                     spotify_profile_image: null
@@ -144,14 +206,11 @@ const LandingPage = ({ user, onLogout, onUserUpdate }) => {
     try {
       setIsLoadingSpotifyData(true);
       
-      const response = await fetch(`${API_BASE_URL}/spotify/user-data`, {
+      const response = await authFetch('/spotify/user-data', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({
-          user_id: user.id
-        }),
       });
 
       const data = await response.json();
@@ -174,14 +233,11 @@ const LandingPage = ({ user, onLogout, onUserUpdate }) => {
 
     try {
       setIsLoadingMusic(true);
-      const response = await fetch(`${API_BASE_URL}/spotify/playlists`, {
+      const response = await authFetch('/spotify/playlists', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({
-          user_id: user.id
-        }),
       });
 
       const data = await response.json();
@@ -203,13 +259,12 @@ const LandingPage = ({ user, onLogout, onUserUpdate }) => {
 
     try {
       setIsLoadingMusic(true);
-      const response = await fetch(`${API_BASE_URL}/spotify/top-tracks`, {
+      const response = await authFetch('/spotify/top-tracks', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
-          user_id: user.id,
           time_range: timeRange,
           limit: 20
         }),
@@ -234,13 +289,12 @@ const LandingPage = ({ user, onLogout, onUserUpdate }) => {
 
     try {
       setIsLoadingMusic(true);
-      const response = await fetch(`${API_BASE_URL}/spotify/recently-played`, {
+      const response = await authFetch('/spotify/recently-played', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
-          user_id: user.id,
           limit: 20
         }),
       });
@@ -264,13 +318,12 @@ const LandingPage = ({ user, onLogout, onUserUpdate }) => {
 
     try {
       setIsLoadingMusic(true);
-      const response = await fetch(`${API_BASE_URL}/spotify/top-artists`, {
+      const response = await authFetch('/spotify/top-artists', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
-          user_id: user.id,
           time_range: timeRange,
           limit: 20
         }),
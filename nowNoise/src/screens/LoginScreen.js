@@ -286,7 +286,11 @@ const LoginScreen = ({ onLoginSuccess, onSwitchToSignup }) => {
         
         // Call success callback immediately - no alert needed
         if (onLoginSuccess) {
-          onLoginSuccess(data.user);
+          onLoginSuccess({
+            ...data.user,
+            access_token: data.access_token,
+            refresh_token: data.refresh_token,
+          });
         }
       } else {
         Alert.alert('Login Failed', data.error || 'Invalid credentials');
@@ -52,7 +52,11 @@ const MultiStepSignup = ({ onSignupSuccess, onSwitchToLogin }) => {
           genres: [],
           profilePicture: null,
         });
-        onSignupSuccess(data.user);
+        onSignupSuccess({
+          ...data.user,
+          access_token: data.access_token,
+          refresh_token: data.refresh_token,
+        });
       } else {
         throw new Error(data.error || 'Signup failed');
       }